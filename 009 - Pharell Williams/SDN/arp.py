@@ -0,0 +1,188 @@
+"""
+ARP and IPv6 neighbor discovery handling for the PyThess controller.
+"""
+
+import binascii
+import time
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.packet.arp import arp
+from pox.lib.packet.ethernet import ethernet
+from pox.lib.packet.icmpv6 import (icmpv6, NDNeighborAdvertisement, NDOptTargetLinkLayerAddress,
+                                   TYPE_NEIGHBOR_ADVERTISEMENT, TYPE_NEIGHBOR_SOLICITATION)
+from pox.lib.packet.ipv6 import ipv6
+from pox.lib.recoco import Timer
+from topology import int_to_mac, mac_to_int
+log = core.getLogger()
+
+ICMPV6 = 58  # IPv6 next header of ICMPv6
+
+
+def ip6_to_int(addr):
+    """
+    An IPAddr6 as a 128 bit int
+    """
+    return int(binascii.hexlify(addr.toRaw()), 16)
+
+
+class ArpProxy(object):
+    """
+    Answers ARP requests from the controller instead of flooding them.
+    IP -> MAC bindings are learned from the sender of every ARP packet and
+    the source of IPv4 traffic and forgotten after max_age seconds without
+    being seen again, so a host that moved or left is asked for again. A
+    request is only flooded when the cache has no fresh binding for it.
+    """
+    NAME = "ARP"
+
+    def __init__(self, max_age=300.0):
+        """
+        Args:
+            max_age: seconds a binding is answered from after we last saw it
+        """
+        self.max_age = max_age
+        self._cache = {}  # IP -> (MAC, when we last saw it), both as ints
+        self.answered = 0  # requests we replied to
+        self.missed = 0  # requests left to flood
+        self._timer = Timer(max_age, self._expire, recurring=True)
+
+    def learn(self, ip, mac, now):
+        """
+        Remember that ip is at mac, both as ints
+        """
+        if ip:
+            self._cache[ip] = (mac, now)
+
+    def lookup(self, ip, now):
+        """
+        The MAC of ip as an int, None if we have no fresh binding
+        """
+        entry = self._cache.get(ip)
+        if entry is None:
+            return None
+        if now - entry[1] > self.max_age:
+            del self._cache[ip]
+            return None
+        return entry[0]
+
+    def handle(self, event, packet, now):
+        """
+        Learn from an ARP PacketIn and answer it if it is a request we know
+        the answer to
+        Args:
+            event: the PacketIn
+            packet: its parsed ethernet packet
+            now: when the PacketIn arrived
+        Returns: True if we replied and the packet should not be forwarded
+        """
+        a = packet.payload
+        sender = a.protosrc.toUnsigned()
+        sender_mac = mac_to_int(a.hwsrc)
+        self.learn(sender, sender_mac, now)
+        # probes (sender 0.0.0.0) are left to the real owner of the address
+        if a.opcode != arp.REQUEST or a.prototype != arp.PROTO_TYPE_IP or not sender:
+            return False
+        mac = self.lookup(a.protodst.toUnsigned(), now)
+        if mac is None or mac == sender_mac:
+            self.missed += 1
+            return False
+
+        reply = arp()
+        reply.hwtype = a.hwtype
+        reply.prototype = a.prototype
+        reply.hwlen = a.hwlen
+        reply.protolen = a.protolen
+        reply.opcode = arp.REPLY
+        reply.hwdst = a.hwsrc
+        reply.protodst = a.protosrc
+        reply.protosrc = a.protodst
+        reply.hwsrc = int_to_mac(mac)
+        frame = ethernet(type=packet.type, src=reply.hwsrc, dst=a.hwsrc)
+        frame.set_payload(reply)
+        self._reply(event, frame)
+        return True
+
+    def _reply(self, event, frame):
+        """
+        Send an answer back out of the port the question came in on
+        """
+        msg = of.ofp_packet_out()
+        msg.data = frame.pack()
+        msg.actions.append(of.ofp_action_output(port=of.OFPP_IN_PORT))
+        msg.in_port = event.port
+        event.connection.send(msg)
+        self.answered += 1
+
+    def _expire(self):
+        now = time.time()
+        stale = [ip for ip, (mac, seen) in self._cache.items() if now - seen > self.max_age]
+        for ip in stale:
+            del self._cache[ip]
+        if self.answered or self.missed:
+            log.debug("%s proxy: %i bindings, %i requests answered, %i flooded",
+                      self.NAME, len(self._cache), self.answered, self.missed)
+
+
+class NdpProxy(ArpProxy):
+    """
+    The IPv6 counterpart of ArpProxy: answers neighbor solicitations with a
+    neighbor advertisement from the controller's cache instead of flooding
+    them. Bindings are learned from the source of every IPv6 packet and the
+    target of neighbor advertisements, in a cache of its own.
+    """
+    NAME = "NDP"
+
+    def handle(self, event, packet, now):
+        """
+        Learn from an IPv6 PacketIn and answer it if it is a neighbor
+        solicitation we know the answer to
+        Args:
+            event: the PacketIn
+            packet: its parsed ethernet packet
+            now: when the PacketIn arrived
+        Returns: True if we replied and the packet should not be forwarded
+        """
+        ip = packet.find("ipv6")
+        if ip is None:
+            return False
+        sender = ip6_to_int(ip.srcip)
+        sender_mac = mac_to_int(packet.src)
+        self.learn(sender, sender_mac, now)
+        icmp = packet.find("icmpv6")
+        if icmp is None:
+            return False
+        if icmp.type == TYPE_NEIGHBOR_ADVERTISEMENT:
+            advertisement = packet.find("NDNeighborAdvertisement")
+            if advertisement is not None:
+                self.learn(ip6_to_int(advertisement.target), sender_mac, now)
+            return False
+        # duplicate address detection (source ::) is left to the real owner
+        solicitation = packet.find("NDNeighborSolicitation")
+        if icmp.type != TYPE_NEIGHBOR_SOLICITATION or solicitation is None or not sender:
+            return False
+        mac = self.lookup(ip6_to_int(solicitation.target), now)
+        if mac is None or mac == sender_mac:
+            self.missed += 1
+            return False
+
+        advertisement = NDNeighborAdvertisement()
+        advertisement.target = solicitation.target
+        advertisement.is_solicited = True
+        advertisement.is_override = True
+        option = NDOptTargetLinkLayerAddress()
+        option.address = int_to_mac(mac)
+        advertisement.options.append(option)
+        reply = icmpv6()
+        reply.type = TYPE_NEIGHBOR_ADVERTISEMENT
+        reply.set_payload(advertisement)
+        header = ipv6()
+        header.srcip = solicitation.target
+        header.dstip = ip.srcip
+        header.next_header_type = ICMPV6
+        header.hop_limit = 255  # anything else is not neighbor discovery
+        header.set_payload(reply)  # the checksum's pseudo header comes from here
+        frame = ethernet(type=packet.type, src=option.address, dst=packet.src)
+        frame.set_payload(header)
+        self._reply(event, frame)
+        return True
@@ -0,0 +1,91 @@
+"""
+Benchmark link failover with precomputed backup paths.
+
+Installs shortest paths between random host pairs on a simulated topology
+(the one bench_topology.py builds), then takes fabric links down one at a
+time and times how long BackupPaths takes to move the affected pairs,
+against computing new paths for them after the failure:
+
+    python bench_failover.py --switches 500 --pairs 2000 --failures 50
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import random
+import time
+
+import networkx as nx
+
+from bench_topology import build
+from failover import BackupPaths, switch_edges
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="failover time with precomputed backup paths")
+    parser.add_argument("--switches", type=int, default=500)
+    parser.add_argument("--hosts", type=int, default=2, help="hosts per switch")
+    parser.add_argument("--degree", type=int, default=4, help="links per switch")
+    parser.add_argument("--pairs", type=int, default=2000, help="host pairs with a path installed")
+    parser.add_argument("--failures", type=int, default=50, help="links taken down, one at a time")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    graph, hosts = build(args.switches, args.hosts, args.degree, args.seed)
+    rng = random.Random(args.seed)
+    backups = BackupPaths()
+    for _ in range(args.pairs):
+        source, target = rng.sample(hosts, 2)
+        path = nx.shortest_path(graph, source, target)
+        backups.track(source, target, path)
+        backups.track(target, source, path[::-1])
+    print("%d nodes, %d edges, %d paths" % (graph.number_of_nodes(), graph.number_of_edges(), len(backups)))
+
+    started = time.time()
+    backups.compute(graph)
+    elapsed = time.time() - started
+    print("Backups for %d of %d paths in %.1f s (%.2f ms a path)"
+          % (backups.covered(), len(backups), elapsed, elapsed * 1000 / max(len(backups), 1)))
+
+    used = sorted(set(edge for pair, path in backups._primary.items() for edge in switch_edges(path)))
+    failover_ms, recompute_ms, moved, flow_mods = [], [], [], []
+    for u, v in rng.sample(used, min(args.failures, len(used))):
+        data = graph.get_edge_data(u, v)
+
+        started = time.time()
+        moves = backups.link_down(u, v)
+        failover_ms.append((time.time() - started) * 1000)
+        moved.append(len(moves))
+        # rules written: the new path's switches, plus deletes on the old one's left behind
+        flow_mods.append(sum(len(new) - 2 + len(set(old[1:-1]) - set(new[1:-1])) if new else len(old) - 2
+                             for pair, old, new in moves))
+
+        graph.remove_edge(u, v)
+        started = time.time()
+        for (source, target), old, new in moves:
+            try:
+                nx.shortest_path(graph, source, target)
+            except nx.NetworkXNoPath:
+                pass
+        recompute_ms.append((time.time() - started) * 1000)
+
+        # back to the full fabric with every backup ready for the next failure
+        graph.add_edge(u, v, **data)
+        backups.link_up(u, v)
+        backups.compute(graph)
+
+    print("\n%d link failures, %.1f paths moved per failure, %.1f flow mods per failure"
+          % (len(moved), sum(moved) / len(moved), sum(flow_mods) / len(flow_mods)))
+    print("\n%-26s %10s %10s %10s" % ("", "mean ms", "p50 ms", "p99 ms"))
+    for name, values in (("backup failover", failover_ms), ("recompute after failure", recompute_ms)):
+        print("%-26s %10.3f %10.3f %10.3f" % (name, sum(values) / len(values), percentile(values, 0.5),
+                                              percentile(values, 0.99)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark path computation on networkx against CompactGraph.
+
+Builds a topology with nodes numbered the way the controller's
+AddressIndex numbers them (switches then hosts, as small ints) and times
+shortest paths between random host pairs, on the networkx graph and on
+its CompactGraph CSR copy, hop count and weighted, and whole BFS trees:
+
+    python bench_topology.py --switches 2000 --hosts 4
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import random
+import time
+
+import networkx as nx
+
+from compact_graph import CompactGraph
+
+
+def build(switches, hosts, degree, seed):
+    """
+    A random regular switch fabric with hosts hanging off every switch,
+    weights as the controller sets them. Switches are nodes 0 to
+    switches - 1, the hosts follow.
+    """
+    fabric = nx.random_regular_graph(degree, switches, seed=seed)
+    graph = nx.Graph()
+    graph.add_nodes_from(range(switches))
+    for u, v in fabric.edges():
+        graph.add_edge(u, v, weight=100)
+    ends = []
+    for i in range(switches):
+        for h in range(hosts):
+            host = switches + i * hosts + h
+            graph.add_edge(i, host, weight=10)
+            ends.append(host)
+    return graph, ends
+
+
+def timed(function, pairs):
+    started = time.time()
+    paths = [function(s, t) for s, t in pairs]
+    return (time.time() - started) / len(pairs), paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="networkx against CompactGraph path computation")
+    parser.add_argument("--switches", type=int, default=2000)
+    parser.add_argument("--hosts", type=int, default=4, help="hosts per switch")
+    parser.add_argument("--degree", type=int, default=4, help="links per switch")
+    parser.add_argument("--pairs", type=int, default=200, help="host pairs to route")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    graph, hosts = build(args.switches, args.hosts, args.degree, args.seed)
+    rng = random.Random(args.seed)
+    ends = hosts or list(graph)
+    pairs = [tuple(rng.sample(ends, 2)) for _ in range(args.pairs)]
+    print("%d nodes, %d edges, %d host pairs" % (graph.number_of_nodes(), graph.number_of_edges(), len(pairs)))
+
+    started = time.time()
+    compact = CompactGraph(graph)
+    print("CompactGraph built in %.1f ms" % ((time.time() - started) * 1000))
+
+    runs = [
+        ("hop count", lambda s, t: nx.shortest_path(graph, s, t),
+         lambda s, t: compact.shortest_path(s, t)),
+        ("weighted", lambda s, t: nx.dijkstra_path(graph, s, t),
+         lambda s, t: compact.shortest_path(s, t, weighted=True)),
+        ("bfs tree", lambda s, t: nx.predecessor(graph, s),
+         lambda s, t: compact.bfs_parents(s)),
+    ]
+    print("\n%-10s %14s %14s %8s" % ("", "networkx ms", "compact ms", "speedup"))
+    for name, slow, fast in runs:
+        slow_time, slow_paths = timed(slow, pairs)
+        fast_time, fast_paths = timed(fast, pairs)
+        if name != "bfs tree":
+            assert [len(p) for p in slow_paths] == [len(p) for p in fast_paths], "path lengths differ"
+        print("%-10s %14.3f %14.3f %7.1fx" % (name, slow_time * 1000, fast_time * 1000, slow_time / fast_time))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Controller state checkpoints and warm restart for the PyThess controller.
+"""
+
+import gzip
+import json
+import os
+import time
+
+import networkx as nx
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from pox.lib.util import dpid_to_str
+from flows import RuleCompiler
+from topology import mac_to_int
+log = core.getLogger()
+
+FORMAT = 1
+
+
+class Checkpointer(object):
+    """
+    Periodically writes what the controller learned (node numbering,
+    topology, switch link ports, host ports, the learning table, IPv4 and
+    IPv6 to MAC bindings and the installed paths) to a gzipped JSON file,
+    and loads it back on start so the controller forwards right away
+    instead of relearning everything through floods and LLDP.
+
+    The switches may have kept their rules through the restart or lost
+    them, so every switch that was in the checkpoint has its flow table read
+    once when it connects. Path rules we expect but the switch lacks are
+    installed again, path rules the switch has but we do not expect are
+    deleted. Learned rules have timeouts and are left to expire.
+    """
+    def __init__(self, controller, path, interval=30.0, max_age=600.0):
+        """
+        Args:
+            controller: the SimpleController whose state we save
+            path: the checkpoint file
+            interval: seconds between two checkpoints
+            max_age: a checkpoint older than this is not loaded
+        """
+        self.controller = controller
+        self.path = path
+        self.max_age = max_age
+        self._unreconciled = set()  # dpids from the checkpoint whose rules we did not check yet
+        self._requests = {}  # dpid -> xid of the request for its whole flow table
+        core.openflow.addListenerByName("ConnectionUp", self._handle_ConnectionUp)
+        core.openflow.addListenerByName("FlowStatsReceived", self._handle_flowstats_received)
+        self._timer = Timer(interval, self.save, recurring=True)
+
+    def state(self):
+        """
+        The controller's state as plain lists, for JSON
+        """
+        c = self.controller
+        return {
+            "format": FORMAT,
+            "saved": time.time(),
+            "kinds": c.addresses.kinds,
+            "addresses": c.addresses.addresses,
+            "edges": [(u, v, data.get("weight", 1)) for u, v, data in c.topology.edges(data=True)],
+            "links": [(s1, s2, p1, p2) for (s1, s2), (p1, p2) in c.switch_links_to_port.items()],
+            "host_ports": list(c.mac_to_port.items()),
+            "table": [(dpid, list(ports.items())) for dpid, ports in c.table.items()],
+            "ip_to_mac": list(c.ip_to_mac.items()),
+            "ip6_to_mac": list(c.ip6_to_mac.items()),
+            "paths": list(c.paths_applied.values()),
+        }
+
+    def save(self):
+        """
+        Write a checkpoint, through a temporary file so a crash mid-write
+        leaves the previous one in place
+        """
+        started = time.time()
+        data = json.dumps(self.state(), separators=(",", ":")).encode("utf-8")
+        temporary = self.path + ".tmp"
+        try:
+            with gzip.open(temporary, "wb") as f:
+                f.write(data)
+            os.rename(temporary, self.path)
+        except (IOError, OSError) as e:
+            log.warning("Could not write checkpoint %s: %s", self.path, e)
+            return
+        log.debug("Checkpoint of %i bytes written in %.1f ms", len(data), (time.time() - started) * 1000)
+
+    def load(self):
+        """
+        Restore the controller from the checkpoint, if there is a recent one
+        Returns: True if state was restored
+        """
+        try:
+            with gzip.open(self.path, "rb") as f:
+                state = json.loads(f.read().decode("utf-8"))
+        except (IOError, OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                log.warning("Ignoring unreadable checkpoint %s: %s", self.path, e)
+            return False
+        age = time.time() - state.get("saved", 0)
+        if state.get("format") != FORMAT or age > self.max_age:
+            log.info("Ignoring checkpoint %s, %i seconds old", self.path, age)
+            return False
+
+        c = self.controller
+        c.addresses.load(state["kinds"], state["addresses"])
+        c.topology_store.apply([(self._restore_topology, (state["edges"],))])
+        c.switch_links_to_port.update(((s1, s2), (p1, p2)) for s1, s2, p1, p2 in state["links"])
+        c.mac_to_port.update((host, port) for host, port in state["host_ports"])
+        for dpid, ports in state["table"]:
+            c.table[dpid].update((mac, port) for mac, port in ports)
+        c.ip_to_mac.update((ip, mac) for ip, mac in state["ip_to_mac"])
+        c.ip6_to_mac.update((ip, mac) for ip, mac in state.get("ip6_to_mac", ()))
+        for path in state["paths"]:
+            c.paths_applied.set((path[0], path[-1]), path, c.topology_version)
+            c.backups.track(path[0], path[-1], path)
+            if c.rule_compiler is not None:
+                c.rule_compiler.add(path[0], path[-1], c.path_hops(path))
+        self._unreconciled = set(c.addresses.address(node) for node in c.topology
+                                 if not c.addresses.is_host(node))
+        log.info("Warm start from %s (%i seconds old): %i nodes, %i paths", self.path, age,
+                 len(state["kinds"]), len(state["paths"]))
+        return True
+
+    def _restore_topology(self, graph, edges):
+        for u, v, weight in edges:
+            graph.add_edge(u, v, weight=weight)
+        cycles = nx.cycle_basis(graph)
+        self.controller.loop = cycles[0] if cycles else []
+
+    def _handle_ConnectionUp(self, event):
+        if event.dpid in self._unreconciled:
+            msg = of.ofp_stats_request(body=of.ofp_flow_stats_request())
+            self._requests[event.dpid] = msg.xid
+            event.connection.send(msg)
+
+    def expected_rules(self, switch):
+        """
+        The path rules a switch should hold
+        Returns: dict of (priority, in_port or None, source or None, target)
+        -> out_port, hosts as nodes
+        """
+        c = self.controller
+        if c.rule_compiler is not None:
+            return dict(((RuleCompiler.DEFAULT_PRIORITY if source is None else RuleCompiler.EXACT_PRIORITY,
+                          None, source, target), out_port)
+                        for source, target, out_port in c.rule_compiler.rules(switch))
+        rules = {}
+        for (source, target), path in c.paths_applied.items():
+            if switch in path:
+                for hop_switch, in_port, out_port in c.path_hops(path):
+                    if hop_switch == switch and in_port is not None and out_port is not None:
+                        rules[RuleCompiler.EXACT_PRIORITY, in_port, source, target] = out_port
+        return rules
+
+    def _handle_flowstats_received(self, event):
+        """
+        Bring the path rules of a switch from the checkpoint in line with
+        what we expect it to hold
+        """
+        dpid = event.connection.dpid
+        # the stats collector asks for slices of the table too, only the
+        # reply to our own request holds all of it
+        if dpid not in self._unreconciled or self._requests.get(dpid) != event.ofp[0].xid:
+            return
+        self._unreconciled.discard(dpid)
+        del self._requests[dpid]
+        c = self.controller
+        switch = c.addresses.switch(dpid)
+        expected = self.expected_rules(switch)
+        stale = []
+        kept = 0
+        for entry in event.stats:
+            if entry.priority not in (RuleCompiler.DEFAULT_PRIORITY, RuleCompiler.EXACT_PRIORITY):
+                continue
+            match = entry.match
+            source = None if match.dl_src is None else c.addresses.find_host(mac_to_int(match.dl_src))
+            target = None if match.dl_dst is None else c.addresses.find_host(mac_to_int(match.dl_dst))
+            out_ports = [a.port for a in entry.actions if isinstance(a, of.ofp_action_output)]
+            key = (entry.priority, match.in_port, source, target)
+            if target is not None and out_ports and expected.get(key) == out_ports[0]:
+                del expected[key]
+                kept += 1
+            else:
+                stale.append(entry)
+
+        for entry in stale:
+            msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+            msg.match = entry.match
+            msg.priority = entry.priority
+            event.connection.send(msg)
+        for (priority, in_port, source, target), out_port in expected.items():
+            if c.rule_compiler is not None:
+                c.send_rules([(switch, source, target, out_port, of.OFPFC_ADD)])
+            else:
+                c.send_path_flows(source, target, [(switch, in_port, out_port)])
+        log.info("Reconciled %s with the checkpoint: %i path rules kept, %i deleted, %i installed again",
+                 dpid_to_str(dpid), kept, len(stale), len(expected))
@@ -0,0 +1,180 @@
+"""
+Membership, switch ownership and a message bus for running several
+controllers over one fabric.
+"""
+
+import json
+import socket
+import threading
+import time
+import zlib
+
+
+def parse_members(members):
+    """
+    "host:port,host:port,..." as a list of (host, port)
+    """
+    parsed = []
+    for member in members.split(","):
+        host, port = member.strip().rsplit(":", 1)
+        parsed.append((host, int(port)))
+    return parsed
+
+
+class ClusterBus(object):
+    """
+    JSON messages between the controllers of a cluster, one UDP datagram
+    each. Every member listens on its own address of the member list and a
+    daemon thread hands what arrives to deliver(message). Messages carry
+    the index of their sender in "from".
+    """
+    MAX_DATAGRAM = 60000
+
+    def __init__(self, members, me, deliver):
+        """
+        Args:
+            members: list of (host, port), the same on every member
+            me: our index in members
+            deliver: called with every message received, on the bus thread
+        """
+        self.members = members
+        self.me = me
+        self.deliver = deliver
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(members[me])
+        self._thread = threading.Thread(target=self._run, name="cluster-bus")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def send(self, message, to=None):
+        """
+        Send a message to one member, or to every other member if to is None
+        """
+        message["from"] = self.me
+        data = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        targets = [to] if to is not None else [i for i in range(len(self.members)) if i != self.me]
+        for member in targets:
+            try:
+                self.socket.sendto(data, self.members[member])
+            except socket.error:
+                pass  # a dead member shows up as missing heartbeats
+
+    def _run(self):
+        while True:
+            try:
+                data, address = self.socket.recvfrom(self.MAX_DATAGRAM)
+                message = json.loads(data.decode("utf-8"))
+            except (socket.error, ValueError):
+                continue
+            if isinstance(message, dict) and message.get("from") in range(len(self.members)):
+                self.deliver(message)
+
+
+class Membership(object):
+    """
+    Which members are alive, from their heartbeats, and which member owns
+    each switch. Ownership is by rendezvous hashing of the dpid over the
+    live members: every member computes the same owner without talking, and
+    when a member dies only its switches move, spread over the others.
+    """
+    def __init__(self, size, me, dead_after=3.0):
+        """
+        Args:
+            size: how many members the cluster has
+            me: our index
+            dead_after: seconds without a heartbeat before a member is dead
+        """
+        self.size = size
+        self.me = me
+        self.dead_after = dead_after
+        # live member -> last heartbeat. Everyone counts as alive from the
+        # start, so ownership does not swing round while the first heartbeats
+        # come in, and the silent ones expire after dead_after. We never do.
+        now = time.time()
+        self._heard = dict((member, now) for member in range(size))
+        self._heard[me] = float("inf")
+        self._owners = {}  # dpid -> owner, cleared when membership changes
+
+    def alive(self):
+        return sorted(self._heard)
+
+    def heard(self, member, now):
+        """
+        A heartbeat from a member
+        Returns: True if the member was not alive before
+        """
+        joined = member not in self._heard
+        self._heard[member] = now
+        if joined:
+            self._owners = {}
+        return joined
+
+    def expire(self, now):
+        """
+        Drop the members whose heartbeats stopped
+        Returns: list of the members found dead
+        """
+        dead = [member for member, heard in self._heard.items() if now - heard > self.dead_after]
+        for member in dead:
+            del self._heard[member]
+        if dead:
+            self._owners = {}
+        return dead
+
+    def owner(self, dpid):
+        owner = self._owners.get(dpid)
+        if owner is None:
+            owner = self._owners[dpid] = max(self._heard, key=lambda member: self._weight(member, dpid))
+        return owner
+
+    def owns(self, dpid):
+        return self.owner(dpid) == self.me
+
+    @staticmethod
+    def _weight(member, dpid):
+        return zlib.crc32(("%d-%d" % (member, dpid)).encode()) & 0xffffffff
+
+
+def main():
+    """
+    Runs one member of a test cluster without POX, owning switches 1 to
+    --switches and printing its share whenever membership changes. Start a
+    few in separate terminals, kill one and watch its switches move:
+
+        python cluster.py --members 127.0.0.1:7001,127.0.0.1:7002,127.0.0.1:7003 --me 0
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description="one member of a test controller cluster")
+    parser.add_argument("--members", required=True, help="host:port of every member, comma separated")
+    parser.add_argument("--me", type=int, required=True, help="our index in --members")
+    parser.add_argument("--switches", type=int, default=64)
+    parser.add_argument("--heartbeat", type=float, default=1.0)
+    args = parser.parse_args()
+
+    members = parse_members(args.members)
+    membership = Membership(len(members), args.me, dead_after=3 * args.heartbeat)
+    lock = threading.Lock()
+
+    def deliver(message):
+        with lock:
+            if membership.heard(message["from"], time.time()):
+                report("member %d up" % message["from"])
+
+    def report(why):
+        owned = [dpid for dpid in range(1, args.switches + 1) if membership.owns(dpid)]
+        print("%.3f %s, alive %s, owning %d switches: %s" % (time.time(), why, membership.alive(), len(owned),
+                                                             " ".join(str(dpid) for dpid in owned)))
+
+    bus = ClusterBus(members, args.me, deliver)
+    report("started")
+    while True:
+        bus.send({"type": "hello"})
+        time.sleep(args.heartbeat)
+        with lock:
+            for member in membership.expire(time.time()):
+                report("member %d dead" % member)
+
+
+if __name__ == "__main__":
+    main()
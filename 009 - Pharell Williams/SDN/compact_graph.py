@@ -0,0 +1,179 @@
+"""
+Array backed graph for fast path computation on large topologies.
+"""
+
+import heapq
+
+import networkx as nx
+import numpy as np
+
+
+class CompactGraph(object):
+    """
+    A read only copy of a networkx graph in compressed sparse row form.
+    Nodes are numbered 0..n-1 and the neighbours of node i are
+    indices[indptr[i]:indptr[i+1]], with the edge weights alongside in
+    weights. A full breadth first search tree expands a whole frontier per
+    step with numpy. Single paths are searched on plain int lists made from
+    the same arrays, bidirectionally for hop count.
+    """
+    def __init__(self, graph, weight="weight"):
+        """
+        Args:
+            graph: the networkx graph to copy, undirected
+            weight: the edge attribute with the weight, missing means 1
+        """
+        self.nodes = list(graph)
+        self.index = dict((node, i) for i, node in enumerate(self.nodes))
+        count = len(self.nodes)
+        src, dst, weights = [], [], []
+        index = self.index
+        for u, v, data in graph.edges(data=True):
+            i, j = index[u], index[v]
+            w = data.get(weight, 1)
+            src.extend((i, j))
+            dst.extend((j, i))
+            weights.extend((w, w))
+        src = np.array(src, dtype=np.int64)
+        order = np.argsort(src, kind="mergesort")
+        self.indices = np.array(dst, dtype=np.int64)[order]
+        self.weights = np.array(weights, dtype=float)[order]
+        self.indptr = np.zeros(count + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=count), out=self.indptr[1:])
+        self._lists = None
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def bfs_parents(self, source, target=None):
+        """
+        Breadth first search from source, stopping early once target is found
+        Returns: numpy array with the parent of every node on a shortest
+        path from source, -1 for nodes not reached, source is its own parent
+        """
+        parent = np.full(len(self.nodes), -1, dtype=np.int64)
+        start = self.index[source]
+        goal = self.index.get(target, -1)
+        parent[start] = start
+        frontier = np.array([start], dtype=np.int64)
+        while frontier.size:
+            starts = self.indptr[frontier]
+            counts = self.indptr[frontier + 1] - starts
+            total = counts.sum()
+            if not total:
+                break
+            # where every neighbour of the frontier sits in indices
+            offsets = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(total)
+            neighbours = self.indices[offsets]
+            owners = np.repeat(frontier, counts)
+            new = parent[neighbours] == -1
+            neighbours, first = np.unique(neighbours[new], return_index=True)
+            parent[neighbours] = owners[new][first]
+            if goal >= 0 and parent[goal] != -1:
+                break
+            frontier = neighbours
+        return parent
+
+    def dijkstra(self, source, target=None):
+        """
+        Dijkstra from source on the edge weights, stopping once target is settled
+        Returns: (dist, parent) lists, unreached nodes have parent -1
+        """
+        indptr, indices, weights = self._as_lists()
+        start = self.index[source]
+        goal = self.index.get(target, -1)
+        dist = [float("inf")] * len(self.nodes)
+        parent = [-1] * len(self.nodes)
+        dist[start] = 0
+        parent[start] = start
+        heap = [(0, start)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            if u == goal:
+                break
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                nd = d + weights[k]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    parent[v] = u
+                    heapq.heappush(heap, (nd, v))
+        return dist, parent
+
+    def _as_lists(self):
+        if self._lists is None:
+            self._lists = (self.indptr.tolist(), self.indices.tolist(), self.weights.tolist())
+        return self._lists
+
+    def bidirectional_bfs(self, source, target):
+        """
+        Hop count shortest path, searching from both ends and always growing
+        the smaller frontier
+        Returns: list of node numbers from source to target, None if there is
+        no path
+        """
+        indptr, indices, _ = self._as_lists()
+        start, goal = self.index[source], self.index[target]
+        if start == goal:
+            return [start]
+        pred = {start: start}
+        succ = {goal: goal}
+        forward, backward = [start], [goal]
+        while forward and backward:
+            if len(forward) <= len(backward):
+                frontier, seen, other = forward, pred, succ
+            else:
+                frontier, seen, other = backward, succ, pred
+            grown = []
+            for u in frontier:
+                for v in indices[indptr[u]:indptr[u + 1]]:
+                    if v in seen:
+                        continue
+                    seen[v] = u
+                    if v in other:
+                        return self._join(v, pred, succ)
+                    grown.append(v)
+            if frontier is forward:
+                forward = grown
+            else:
+                backward = grown
+        return None
+
+    def _join(self, meet, pred, succ):
+        path = [meet]
+        node = meet
+        while pred[node] != node:
+            node = pred[node]
+            path.append(node)
+        path.reverse()
+        node = meet
+        while succ[node] != node:
+            node = succ[node]
+            path.append(node)
+        return path
+
+    def shortest_path(self, source, target, weighted=False):
+        """
+        Shortest path between two nodes, on hop count or on the edge weights
+        Returns: the list of nodes from source to target
+        Raises: networkx.NetworkXNoPath if target cannot be reached
+        """
+        if not weighted:
+            path = self.bidirectional_bfs(source, target)
+            if path is None:
+                raise nx.NetworkXNoPath("No path between %s and %s." % (source, target))
+            return [self.nodes[i] for i in path]
+        parent = self.dijkstra(source, target)[1]
+        node = self.index[target]
+        if parent[node] == -1:
+            raise nx.NetworkXNoPath("No path between %s and %s." % (source, target))
+        path = [node]
+        while parent[node] != node:
+            node = int(parent[node])
+            path.append(node)
+        return [self.nodes[i] for i in reversed(path)]
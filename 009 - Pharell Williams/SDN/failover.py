@@ -0,0 +1,151 @@
+"""
+Backup paths for fast failover on link down.
+"""
+
+from collections import defaultdict
+
+import networkx as nx
+
+
+def _edge(u, v):
+    return (u, v) if u < v else (v, u)
+
+
+def switch_edges(path):
+    """
+    The switch to switch edges of a host to host path
+    """
+    return [_edge(u, v) for u, v in zip(path[1:-2], path[2:-1])]
+
+
+class BackupPaths(object):
+    """
+    Keeps a backup for every installed path, sharing no switch to switch
+    link with it, so when a link goes down the paths crossing it can be
+    moved at once without computing anything. Paths and backups are
+    indexed by the links they cross, a failure touches only the pairs
+    behind that link.
+
+    Backups are computed in batches with compute() and recomputed whenever
+    their path changes or a link they cross goes down.
+    """
+    def __init__(self):
+        self._primary = {}  # (source, target) -> installed path
+        self._backup = {}  # (source, target) -> backup path, None if there is no disjoint one
+        self._users = defaultdict(set)  # link -> pairs whose path crosses it
+        self._backup_users = defaultdict(set)  # link -> pairs whose backup crosses it
+        self._stale = set()  # pairs whose backup has to be computed
+        self.down = set()  # links reported down, the topology may not know yet
+
+    def __len__(self):
+        return len(self._primary)
+
+    def covered(self):
+        """
+        How many paths have a backup ready
+        """
+        return sum(1 for backup in self._backup.values() if backup is not None)
+
+    def track(self, source, target, path):
+        """
+        A path was installed for a pair, replacing whatever it had
+        """
+        self.untrack(source, target)
+        pair = (source, target)
+        self._primary[pair] = path
+        edges = switch_edges(path)
+        for edge in edges:
+            self._users[edge].add(pair)
+        if edges:
+            self._stale.add(pair)
+
+    def untrack(self, source, target):
+        pair = (source, target)
+        path = self._primary.pop(pair, None)
+        if path is None:
+            return
+        for edge in switch_edges(path):
+            self._discard(self._users, edge, pair)
+        self._drop_backup(pair)
+        self._stale.discard(pair)
+
+    def backup(self, source, target):
+        return self._backup.get((source, target))
+
+    def compute(self, graph, budget=None):
+        """
+        Compute the backups that are missing or stale
+        Args:
+            graph: the current topology
+            budget: how many pairs to compute at most, None for all
+        Returns: how many were computed
+        """
+        done = 0
+        while self._stale and (budget is None or done < budget):
+            pair = self._stale.pop()
+            self._drop_backup(pair)
+            backup = self._disjoint_path(graph, self._primary[pair])
+            self._backup[pair] = backup
+            if backup is not None:
+                for edge in switch_edges(backup):
+                    self._backup_users[edge].add(pair)
+            done += 1
+        return done
+
+    def _disjoint_path(self, graph, path):
+        avoid = set(switch_edges(path)) | self.down
+        if path[0] not in graph or path[-1] not in graph:
+            return None
+
+        def weight(u, v, data):
+            if _edge(u, v) in avoid:
+                return None  # hides the edge from dijkstra
+            return data.get("weight", 1)
+        try:
+            return nx.dijkstra_path(graph, path[0], path[-1], weight=weight)
+        except (nx.NetworkXNoPath, nx.NodeNotFound):
+            return None
+
+    def link_down(self, u, v):
+        """
+        A link went down. The pairs crossing it switch to their backup, which
+        becomes their path, and backups crossing it are recomputed later.
+        Returns: list of ((source, target), old path, new path or None if
+        the pair had no backup), the caller installs the change
+        """
+        edge = _edge(u, v)
+        self.down.add(edge)
+        for pair in list(self._backup_users.pop(edge, ())):
+            self._drop_backup(pair)
+            self._stale.add(pair)
+        moves = []
+        for pair in list(self._users.get(edge, ())):
+            old = self._primary[pair]
+            new = self._backup.get(pair)
+            if new is not None:
+                self.track(pair[0], pair[1], new)
+            else:
+                self.untrack(*pair)
+            moves.append((pair, old, new))
+        return moves
+
+    def link_up(self, u, v):
+        """
+        A link came back, pairs without a backup get another try
+        """
+        self.down.discard(_edge(u, v))
+        self._stale.update(pair for pair, backup in self._backup.items() if backup is None)
+
+    def _drop_backup(self, pair):
+        backup = self._backup.pop(pair, None)
+        if backup is not None:
+            for edge in switch_edges(backup):
+                self._discard(self._backup_users, edge, pair)
+
+    @staticmethod
+    def _discard(index, edge, pair):
+        pairs = index.get(edge)
+        if pairs is not None:
+            pairs.discard(pair)
+            if not pairs:
+                del index[edge]
@@ -0,0 +1,516 @@
+"""
+Fake OpenFlow 1.0 switches to load test the PyThess controller without
+Mininet, Open vSwitch or root.
+
+Every simulated switch opens its own TCP connection to the controller and
+speaks just enough OpenFlow 1.0 to get through the handshake, forward the
+discovery LLDP frames over its simulated links and answer stats requests,
+so ConnectionUp, LinkEvent, HostEvent, PacketIn and PortStatsReceived are
+all raised by the real POX machinery. On top of that, simulated hosts send
+traffic at a fixed rate and we time how long the controller takes to answer
+each PacketIn with a flow-mod or a packet-out.
+
+Start the controller as usual (./pox.py pythess) and then:
+
+    python fake_switches.py --switches 16 --topo leafspine --rate 500
+"""
+
+from __future__ import division, print_function
+
+import argparse
+import errno
+import random
+import select
+import socket
+import struct
+import time
+from collections import Counter, deque
+
+OFP_VERSION = 0x01
+
+OFPT_HELLO = 0
+OFPT_ECHO_REQUEST = 2
+OFPT_ECHO_REPLY = 3
+OFPT_FEATURES_REQUEST = 5
+OFPT_FEATURES_REPLY = 6
+OFPT_GET_CONFIG_REQUEST = 7
+OFPT_GET_CONFIG_REPLY = 8
+OFPT_PACKET_IN = 10
+OFPT_PACKET_OUT = 13
+OFPT_FLOW_MOD = 14
+OFPT_STATS_REQUEST = 16
+OFPT_STATS_REPLY = 17
+OFPT_BARRIER_REQUEST = 18
+OFPT_BARRIER_REPLY = 19
+
+OFPST_DESC = 0
+OFPST_FLOW = 1
+OFPST_PORT = 4
+OFPST_QUEUE = 5
+
+OFPFC_ADD = 0
+OFPFC_MODIFY = 1
+OFPFC_MODIFY_STRICT = 2
+OFPFC_DELETE = 3
+OFPFC_DELETE_STRICT = 4
+OFPFW_ALL = 0x3fffff
+
+OFPP_MAX = 0xff00
+NO_BUFFER = 0xffffffff
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_LLDP = 0x88cc
+BROADCAST = b"\xff" * 6
+
+OFP_HEADER = struct.Struct("!BBHL")
+MESSAGE_NAMES = {
+    OFPT_PACKET_OUT: "packet_out",
+    OFPT_FLOW_MOD: "flow_mod",
+    OFPT_STATS_REQUEST: "stats_request",
+    OFPT_BARRIER_REQUEST: "barrier_request",
+    OFPT_ECHO_REQUEST: "echo_request",
+}
+
+
+def build_topology(kind, switches, spines=2):
+    """
+    Build the switch to switch links of a topology
+    Args:
+        kind: one of linear, ring, tree, leafspine or mesh
+        switches: the number of switches
+        spines: how many of the switches are spines in a leafspine
+    Returns: a list of (dpid1, dpid2) links and the set of dpids with hosts
+    """
+    dpids = list(range(1, switches + 1))
+    edge = set(dpids)
+    if kind in ("linear", "ring"):
+        links = [(dpids[i], dpids[i + 1]) for i in range(switches - 1)]
+        if kind == "ring" and switches > 2:
+            links.append((dpids[-1], dpids[0]))
+    elif kind == "tree":
+        # binary tree, dpid 1 is the root and only the leaves get hosts
+        links = [((i - 1) // 2 + 1, i + 1) for i in range(1, switches)]
+        edge = set(i + 1 for i in range(switches) if 2 * i + 1 >= switches)
+    elif kind == "leafspine":
+        spine, leaves = dpids[:spines], dpids[spines:]
+        links = [(s, l) for l in leaves for s in spine]
+        edge = set(leaves)
+    elif kind == "mesh":
+        links = [(a, b) for i, a in enumerate(dpids) for b in dpids[i + 1:]]
+    else:
+        raise ValueError("unknown topology %s" % kind)
+    return links, edge
+
+
+def ofp_message(msg_type, xid, body=b""):
+    """
+    Prepend an OpenFlow 1.0 header to a message body
+    """
+    return OFP_HEADER.pack(OFP_VERSION, msg_type, OFP_HEADER.size + len(body), xid) + body
+
+
+def checksum(data):
+    """
+    The internet checksum used in the IPv4 header
+    """
+    if len(data) % 2:
+        data += b"\0"
+    total = sum(struct.unpack("!%dH" % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def udp_frame(src_mac, dst_mac, src_ip, dst_ip, size):
+    """
+    An ethernet frame carrying a UDP datagram between two hosts
+    """
+    payload = b"\0" * max(size - 42, 0)
+    udp = struct.pack("!HHHH", 5001, 5001, 8 + len(payload), 0) + payload
+    ip = struct.pack("!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0, 64, 17, 0, src_ip, dst_ip)
+    ip = ip[:10] + struct.pack("!H", checksum(ip)) + ip[12:]
+    return dst_mac + src_mac + struct.pack("!H", ETH_TYPE_IP) + ip + udp
+
+
+def arp_request(src_mac, src_ip, dst_ip):
+    """
+    A broadcast ARP request, the first thing a new host usually sends
+    """
+    arp = struct.pack("!HHBBH6s4s6s4s", 1, ETH_TYPE_IP, 6, 4, 1, src_mac, src_ip, b"\0" * 6, dst_ip)
+    return BROADCAST + src_mac + struct.pack("!H", ETH_TYPE_ARP) + arp
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile of an already sorted list
+    """
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * pct / 100.0))]
+
+
+class Host(object):
+    """
+    A simulated host hanging off an edge port of a fake switch
+    """
+    def __init__(self, number, switch, port):
+        self.switch = switch
+        self.port = port
+        self.mac = struct.pack("!Q", number)[2:]
+        self.ip = socket.inet_aton("10.%d.%d.%d" % ((number >> 16) & 0xff, (number >> 8) & 0xff, number & 0xff))
+
+
+class FakeSwitch(object):
+    """
+    One simulated OpenFlow 1.0 switch with its own controller connection
+    """
+    def __init__(self, dpid, harness):
+        self.dpid = dpid
+        self.harness = harness
+        self.sock = None
+        self.inbuf = b""
+        self.outbuf = b""
+        self.ports = []  # port numbers in the order they were added
+        self.peers = {}  # port -> (peer switch, peer port)
+        self.port_rate = {}  # port -> simulated load in bytes per second
+        self.flows = {}  # (match, priority) -> flow_mod, our flow table
+        self.connected = False
+        self.xid = 0
+
+    def add_port(self, rate):
+        port = len(self.ports) + 1
+        self.ports.append(port)
+        self.port_rate[port] = rate
+        return port
+
+    def connect(self, address):
+        self.sock = socket.create_connection(address)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.setblocking(0)
+        self.send(OFPT_HELLO, b"")
+
+    def send(self, msg_type, body, xid=None):
+        if xid is None:
+            self.xid += 1
+            xid = self.xid
+        self.outbuf += ofp_message(msg_type, xid, body)
+        self.harness.dirty.add(self)
+
+    def flush(self):
+        try:
+            sent = self.sock.send(self.outbuf)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return
+            raise
+        self.outbuf = self.outbuf[sent:]
+
+    def receive(self):
+        """
+        Read whatever the controller sent us and handle every complete message
+        Returns: False if the controller closed the connection
+        """
+        try:
+            data = self.sock.recv(65536)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return True
+            raise
+        if not data:
+            return False
+        self.inbuf += data
+        while len(self.inbuf) >= OFP_HEADER.size:
+            _, msg_type, length, xid = OFP_HEADER.unpack_from(self.inbuf)
+            if len(self.inbuf) < length:
+                break
+            msg, self.inbuf = self.inbuf[:length], self.inbuf[length:]
+            self.handle(msg_type, xid, msg)
+        return True
+
+    def handle(self, msg_type, xid, msg):
+        """
+        Act on one message from the controller
+        Args:
+            msg_type: the OpenFlow message type
+            xid: the transaction id, echoed back on replies
+            msg: the whole message, header included
+        """
+        self.harness.received[MESSAGE_NAMES.get(msg_type, "other")] += 1
+        if msg_type == OFPT_ECHO_REQUEST:
+            self.send(OFPT_ECHO_REPLY, msg[OFP_HEADER.size:], xid)
+        elif msg_type == OFPT_FEATURES_REQUEST:
+            self.send(OFPT_FEATURES_REPLY, self.features(), xid)
+            self.connected = True
+            self.harness.switch_connected(self)
+        elif msg_type == OFPT_GET_CONFIG_REQUEST:
+            self.send(OFPT_GET_CONFIG_REPLY, struct.pack("!HH", 0, 128), xid)
+        elif msg_type == OFPT_BARRIER_REQUEST:
+            self.send(OFPT_BARRIER_REPLY, b"", xid)
+        elif msg_type == OFPT_STATS_REQUEST:
+            self.handle_stats_request(xid, msg)
+        elif msg_type == OFPT_PACKET_OUT:
+            self.handle_packet_out(msg)
+        elif msg_type == OFPT_FLOW_MOD:
+            self.handle_flow_mod(msg)
+
+    def features(self):
+        body = struct.pack("!QLB3xLL", self.dpid, 256, 1, 0x87, 0xfff)
+        for port in self.ports:
+            body += struct.pack("!H6s16sLLLLLL", port, self.hw_addr(port),
+                                ("s%d-eth%d" % (self.dpid, port)).encode(), 0, 0, 0xa0, 0xa0, 0xa0, 0)
+        return body
+
+    def hw_addr(self, port):
+        return struct.pack("!BBHH", 0x02, 0, self.dpid & 0xffff, port)
+
+    def handle_stats_request(self, xid, msg):
+        stats_type, = struct.unpack_from("!H", msg, OFP_HEADER.size)
+        body = struct.pack("!HH", stats_type, 0)
+        if stats_type == OFPST_DESC:
+            body += struct.pack("!256s256s256s32s256s", b"PyThess", b"fake switch", b"fake_switches.py",
+                                str(self.dpid).encode(), ("s%d" % self.dpid).encode())
+        elif stats_type == OFPST_PORT:
+            body += self.port_stats()
+            self.harness.sent["PortStatsReceived"] += 1
+        self.send(OFPT_STATS_REPLY, body, xid)
+
+    def port_stats(self):
+        """
+        Port counters grow linearly with the port's simulated load
+        """
+        elapsed = time.time() - self.harness.started
+        body = b""
+        for port in self.ports:
+            octets = int(self.port_rate[port] * elapsed / 2)
+            packets = octets // 1000
+            body += struct.pack("!H6x12Q", port, packets, packets, octets, octets, 0, 0, 0, 0, 0, 0, 0, 0)
+        return body
+
+    def handle_packet_out(self, msg):
+        buffer_id, in_port, actions_len = struct.unpack_from("!LHH", msg, OFP_HEADER.size)
+        self.harness.answered(buffer_id, "packet_out")
+        data = msg[16 + actions_len:]
+        if len(data) < 14 or struct.unpack_from("!H", data, 12)[0] != ETH_TYPE_LLDP:
+            return
+        # carry discovery's LLDP across the simulated link, that is what
+        # turns into a LinkEvent on the controller side
+        for port in self.output_ports(msg[16:16 + actions_len]):
+            if port in self.peers:
+                peer, peer_port = self.peers[port]
+                if peer.connected:
+                    peer.packet_in(peer_port, data, NO_BUFFER)
+                    self.harness.sent["LinkEvent"] += 1
+
+    def handle_flow_mod(self, msg):
+        match = msg[OFP_HEADER.size:OFP_HEADER.size + 40]
+        command, _, _, priority, buffer_id = struct.unpack_from("!HHHHL", msg, 56)
+        self.harness.answered(buffer_id, "flow_mod")
+        key = (match, priority)
+        if command in (OFPFC_ADD, OFPFC_MODIFY, OFPFC_MODIFY_STRICT):
+            self.flows[key] = msg
+        elif command == OFPFC_DELETE_STRICT:
+            self.flows.pop(key, None)
+        elif command == OFPFC_DELETE:
+            if struct.unpack_from("!L", match)[0] & OFPFW_ALL == OFPFW_ALL:
+                self.flows.clear()
+            else:
+                for k in [k for k in self.flows if k[0] == match]:
+                    del self.flows[k]
+
+    def output_ports(self, actions):
+        offset = 0
+        while offset + 8 <= len(actions):
+            action_type, length, port = struct.unpack_from("!HHH", actions, offset)
+            if action_type == 0:
+                yield port
+            offset += max(length, 8)
+
+    def packet_in(self, port, frame, buffer_id):
+        self.send(OFPT_PACKET_IN, struct.pack("!LHHBx", buffer_id, len(frame), port, 0) + frame)
+
+
+class Harness(object):
+    """
+    Drives all fake switches from a single poll loop and keeps the numbers
+    """
+    def __init__(self, args):
+        self.args = args
+        self.started = time.time()
+        self.random = random.Random(args.seed)
+        self.sent = Counter()
+        self.received = Counter()
+        self.latency = {"flow_mod": [], "packet_out": []}
+        self.pending = {}  # buffer_id -> time we sent the PacketIn
+        self.pending_order = deque()
+        self.next_buffer = 0
+        self.connected_at = None
+        self.switches = {}
+        self.dirty = set()  # switches with something left to send
+        self.hosts = []
+        self.active_hosts = []
+
+        links, edge = build_topology(args.topo, args.switches, args.spines)
+        for dpid in range(1, args.switches + 1):
+            self.switches[dpid] = FakeSwitch(dpid, self)
+        for a, b in links:
+            s1, s2 = self.switches[a], self.switches[b]
+            rate = self.random.uniform(0, args.port_load) * 125000
+            p1, p2 = s1.add_port(rate), s2.add_port(rate)
+            s1.peers[p1] = (s2, p2)
+            s2.peers[p2] = (s1, p1)
+        for dpid in sorted(edge):
+            for _ in range(args.hosts):
+                switch = self.switches[dpid]
+                port = switch.add_port(self.random.uniform(0, args.port_load) * 125000)
+                self.hosts.append(Host(len(self.hosts) + 1, switch, port))
+
+    def switch_connected(self, switch):
+        self.sent["ConnectionUp"] += 1
+        if self.sent["ConnectionUp"] == len(self.switches):
+            self.connected_at = time.time()
+
+    def buffer_id(self):
+        self.next_buffer = (self.next_buffer + 1) % NO_BUFFER
+        return self.next_buffer
+
+    def answered(self, buffer_id, kind):
+        sent = self.pending.pop(buffer_id, None)
+        if sent is not None:
+            self.latency[kind].append(time.time() - sent)
+
+    def announce_host(self):
+        host = self.hosts[len(self.active_hosts)]
+        other = self.random.choice(self.hosts)
+        host.switch.packet_in(host.port, arp_request(host.mac, host.ip, other.ip), NO_BUFFER)
+        self.active_hosts.append(host)
+        self.sent["HostEvent"] += 1
+
+    def send_traffic(self, now):
+        src, dst = self.random.sample(self.active_hosts, 2)
+        buffer_id = self.buffer_id()
+        frame = udp_frame(src.mac, dst.mac, src.ip, dst.ip, self.args.frame_size)
+        src.switch.packet_in(src.port, frame, buffer_id)
+        self.pending[buffer_id] = now
+        self.pending_order.append((now, buffer_id))
+        self.sent["PacketIn"] += 1
+
+    def send_port_stats(self, switch):
+        switch.send(OFPT_STATS_REPLY, struct.pack("!HH", OFPST_PORT, 0) + switch.port_stats(), 0)
+        self.sent["PortStatsReceived"] += 1
+
+    def expire_pending(self, now):
+        while self.pending_order and now - self.pending_order[0][0] > self.args.timeout:
+            _, buffer_id = self.pending_order.popleft()
+            if self.pending.pop(buffer_id, None) is not None:
+                self.sent["unanswered"] += 1
+
+    def run(self):
+        args = self.args
+        address = (args.controller, args.port)
+        poller = select.poll()
+        by_fd = {}
+        waiting = sorted(self.switches.values(), key=lambda s: s.dpid)
+        switches = list(waiting)
+        self.started = time.time()
+        end = self.started + args.duration
+        traffic_start = None
+        emitted = Counter()
+
+        while True:
+            now = time.time()
+            if now >= end:
+                break
+            elapsed = now - self.started
+
+            # bring switches up at --connect-rate per second
+            due = len(switches) if not args.connect_rate else int(elapsed * args.connect_rate) + 1
+            while waiting and len(switches) - len(waiting) < due:
+                switch = waiting.pop(0)
+                switch.connect(address)
+                by_fd[switch.sock.fileno()] = switch
+                poller.register(switch.sock, select.POLLIN)
+
+            # hosts speak up at --host-rate per second once discovery had time to run
+            if self.connected_at and now - self.connected_at >= args.warmup:
+                if traffic_start is None:
+                    traffic_start = now
+                since = now - traffic_start
+                due = len(self.hosts) if not args.host_rate else int(since * args.host_rate) + 1
+                while len(self.active_hosts) < min(due, len(self.hosts)):
+                    self.announce_host()
+                if len(self.active_hosts) >= 2:
+                    while emitted["PacketIn"] < int(since * args.rate):
+                        self.send_traffic(now)
+                        emitted["PacketIn"] += 1
+                while emitted["PortStatsReceived"] < int(since * args.stats_rate):
+                    self.send_port_stats(switches[emitted["PortStatsReceived"] % len(switches)])
+                    emitted["PortStatsReceived"] += 1
+            self.expire_pending(now)
+
+            dirty, self.dirty = self.dirty, set()
+            for switch in dirty:
+                switch.flush()
+                poller.modify(switch.sock, select.POLLIN | (select.POLLOUT if switch.outbuf else 0))
+            for fd, mask in poller.poll(1):
+                switch = by_fd[fd]
+                if mask & select.POLLOUT:
+                    switch.flush()
+                    if not switch.outbuf:
+                        poller.modify(switch.sock, select.POLLIN)
+                if mask & (select.POLLIN | select.POLLHUP) and not switch.receive():
+                    raise SystemExit("controller closed the connection of switch %d" % switch.dpid)
+
+        self.expire_pending(float("inf"))
+        self.report(time.time() - self.started, traffic_start and time.time() - traffic_start)
+
+    def report(self, elapsed, traffic_elapsed):
+        args = self.args
+        print("topology: %s, %d switches, %d hosts" % (args.topo, len(self.switches), len(self.hosts)))
+        if self.connected_at:
+            print("all switches connected in %.2fs" % (self.connected_at - self.started))
+        else:
+            print("only %d/%d switches connected" % (self.sent["ConnectionUp"], len(self.switches)))
+        print("\nevents sent to the controller (total, per second):")
+        for name in ("ConnectionUp", "LinkEvent", "HostEvent", "PacketIn", "PortStatsReceived"):
+            print("  %-18s %8d %10.1f" % (name, self.sent[name], self.sent[name] / elapsed))
+        print("\nmessages from the controller (total, per second):")
+        for name, count in sorted(self.received.items()):
+            print("  %-18s %8d %10.1f" % (name, count, count / elapsed))
+        print("\nPacketIn answered with (ms):")
+        for kind, values in sorted(self.latency.items()):
+            values = sorted(v * 1000 for v in values)
+            print("  %-10s n=%-7d p50 %7.2f  p90 %7.2f  p99 %7.2f  max %7.2f" % (
+                kind, len(values), percentile(values, 50), percentile(values, 90),
+                percentile(values, 99), values[-1] if values else 0))
+        answered = sum(len(v) for v in self.latency.values())
+        print("  unanswered after %.1fs: %d" % (args.timeout, self.sent["unanswered"]))
+        if traffic_elapsed:
+            print("  answered PacketIns per second: %.1f" % (answered / traffic_elapsed))
+        tables = [len(s.flows) for s in self.switches.values()]
+        print("\nflow table entries: %d total, %d max per switch" % (sum(tables), max(tables)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--controller", default="127.0.0.1", help="controller address")
+    parser.add_argument("--port", type=int, default=6633, help="controller OpenFlow port")
+    parser.add_argument("--switches", type=int, default=4, help="number of switches")
+    parser.add_argument("--topo", default="linear", choices=("linear", "ring", "tree", "leafspine", "mesh"))
+    parser.add_argument("--spines", type=int, default=2, help="spine switches in a leafspine topology")
+    parser.add_argument("--hosts", type=int, default=2, help="hosts per edge switch")
+    parser.add_argument("--connect-rate", type=float, default=0, help="switches connecting per second, 0 for all at once")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds to let discovery find the links before the hosts talk")
+    parser.add_argument("--host-rate", type=float, default=50, help="new hosts per second, 0 for all at once")
+    parser.add_argument("--rate", type=float, default=100, help="PacketIns per second from host traffic")
+    parser.add_argument("--stats-rate", type=float, default=0, help="unsolicited port stats replies per second")
+    parser.add_argument("--port-load", type=float, default=10, help="maximum simulated load per port in Mbit/s")
+    parser.add_argument("--frame-size", type=int, default=128, help="size of the traffic frames in bytes")
+    parser.add_argument("--timeout", type=float, default=5, help="seconds after which a PacketIn counts as unanswered")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to run")
+    parser.add_argument("--seed", type=int, default=None)
+    Harness(parser.parse_args()).run()
+
+
+if __name__ == "__main__":
+    main()
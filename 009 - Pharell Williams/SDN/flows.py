@@ -0,0 +1,422 @@
+"""
+Flow installation helpers for the PyThess controller.
+"""
+
+import heapq
+import math
+import time
+from collections import defaultdict, deque
+
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from pox.lib.util import dpid_to_str
+log = core.getLogger()
+
+
+class ProactiveInstaller(object):
+    """
+    Installs the paths between a newly discovered host and every other known
+    host before their first packet, so it is forwarded at line rate instead
+    of going through the controller. Host pairs are queued and installed in
+    small batches from a timer, within a budget of flow mods per second for
+    each switch, so a host joining a big fabric does not bury its switches.
+    """
+    def __init__(self, controller, rate=50, burst=100, batch=100, retries=20, tick=0.1):
+        """
+        Args:
+            controller: the SimpleController whose paths we install
+            rate: flow mods per second each switch gets at most
+            burst: flow mods a switch can get at once after being idle
+            batch: host pairs looked at per tick at most
+            retries: ticks a pair waits for its path to be known before we
+                give up on it (the PacketIn path still covers it)
+            tick: seconds between batches
+        """
+        self.controller = controller
+        self.rate = float(rate)
+        self.burst = burst
+        self.batch = batch
+        self.retries = retries
+        self._pending = deque()  # ((host, host), retries left)
+        self._queued = set()  # the host pairs in _pending
+        self._tokens = {}  # switch -> flow mods it can still get
+        self._last_tick = time.time()
+        self._timer = Timer(tick, self._tick, recurring=True)
+
+    def host_joined(self, mac, hosts):
+        """
+        Queue the paths between a new host and the known ones
+        Args:
+            mac: the new host
+            hosts: every host we know of
+        """
+        for other in hosts:
+            if other == mac:
+                continue
+            pair = (mac, other) if mac < other else (other, mac)
+            if pair not in self._queued:
+                self._queued.add(pair)
+                self._pending.append((pair, self.retries))
+
+    def _tick(self):
+        now = time.time()
+        refill = (now - self._last_tick) * self.rate
+        self._last_tick = now
+        for switch, tokens in self._tokens.items():
+            self._tokens[switch] = min(self.burst, tokens + refill)
+
+        for _ in range(min(self.batch, len(self._pending))):
+            pair, retries = self._pending.popleft()
+            source, target = pair
+            if self.controller.paths_applied.get(pair):
+                self._queued.discard(pair)
+                continue
+            path = self.controller.select_path(source, target)
+            hops = self.controller.path_hops(path) if path else []
+            if not hops or any(port is None for hop in hops for port in hop[1:]):
+                # the topology or a host port is not known yet
+                if retries:
+                    self._pending.append((pair, retries - 1))
+                else:
+                    self._queued.discard(pair)
+                continue
+            # a flow mod per direction on every switch of the path
+            if any(self._tokens.setdefault(switch, self.burst) < 2 for switch, _, _ in hops):
+                self._pending.appendleft((pair, retries))
+                break
+            for switch, _, _ in hops:
+                self._tokens[switch] -= 2
+            self.controller.shortest_path_flow_modifications(path)
+            self._queued.discard(pair)
+
+
+class FlowLifetimeManager(object):
+    """
+    Picks the timeouts of the learning rules installed from PacketIn and
+    keeps every switch under a budget of such rules.
+
+    Each host pair has an exponentially decaying count of its PacketIns, so
+    a pair that keeps coming back gets longer lived rules and one that went
+    quiet is forgotten. Flow removed messages tune that per pair: a rule that
+    idled out only for the pair to miss again right after was too short and
+    the pair's timeouts double, a rule that expired having matched nothing
+    was too long and they halve.
+
+    The decayed count is stored as log(count) + last_seen / tau, which does
+    not change while the pair is quiet, so it can order the rules of a switch
+    in a heap and the coldest rule is evicted when a switch is full.
+    """
+    def __init__(self, half_life=30.0, min_idle=2, max_idle=120, hard_factor=10, max_hard=600,
+                 table_size=1000):
+        """
+        Args:
+            half_life: seconds for a pair's PacketIn count to halve
+            min_idle: idle timeout of a pair seen once
+            max_idle: longest idle timeout we hand out
+            hard_factor: hard timeout as a multiple of the idle timeout
+            max_hard: longest hard timeout we hand out
+            table_size: learning rules a switch may hold before we evict
+        """
+        self.tau = half_life / math.log(2)
+        self.min_idle = min_idle
+        self.max_idle = max_idle
+        self.hard_factor = hard_factor
+        self.max_hard = max_hard
+        self.table_size = table_size
+        self._pairs = {}  # (src, dst) -> [key, boost, idle timed out at, idle timeout]
+        # _pairs is pruned when it grows to this size, then set to twice
+        # what the prune left, so pruning stays amortized O(1) per pair
+        self._prune_at = 10000
+        self._rules = defaultdict(set)  # dpid -> (src, dst) of the rules on it
+        self._heaps = defaultdict(list)  # dpid -> heap of (key, seq, src, dst)
+        self._seq = 0
+        self._evicted = 0
+
+    def score(self, src, dst, now):
+        """
+        The decayed PacketIn count of a host pair
+        """
+        state = self._pairs.get((src, dst))
+        return 0.0 if state is None else math.exp(state[0] - now / self.tau)
+
+    def packet_in(self, src, dst, now):
+        """
+        Count a PacketIn of a host pair
+        """
+        state = self._pairs.get((src, dst))
+        if state is None:
+            if len(self._pairs) >= self._prune_at:
+                self._prune(now)
+            state = self._pairs[src, dst] = [float("-inf"), 1.0, None, self.min_idle]
+        elif state[2] is not None and now - state[2] < state[3]:
+            # the rule idled out and the pair was back within the same time
+            state[1] = min(state[1] * 2, 64.0)
+        state[2] = None
+        state[0] = math.log(math.exp(state[0] - now / self.tau) + 1) + now / self.tau
+
+    def timeouts(self, src, dst, now):
+        """
+        Returns: (idle_timeout, hard_timeout) for a rule of this host pair
+        """
+        state = self._pairs.get((src, dst))
+        boost = 1.0 if state is None else state[1]
+        idle = self.min_idle * boost * (1 + math.log(1 + self.score(src, dst, now), 2))
+        idle = int(min(max(idle, self.min_idle), self.max_idle))
+        if state is not None:
+            state[3] = idle
+        return idle, int(min(idle * self.hard_factor, self.max_hard))
+
+    def installed(self, dpid, src, dst):
+        """
+        Record a rule sent to a switch
+        Returns: list of (src, dst) rules to delete from the switch to make
+        room, the coldest first
+        """
+        rules = self._rules[dpid]
+        rules.add((src, dst))
+        self._push(dpid, src, dst)
+        evict = []
+        heap = self._heaps[dpid]
+        while len(rules) > self.table_size and heap:
+            key, _, old_src, old_dst = heapq.heappop(heap)
+            if (old_src, old_dst) not in rules:
+                continue
+            state = self._pairs.get((old_src, old_dst))
+            if state is not None and state[0] != key:
+                # the pair got warmer since this entry was pushed
+                self._push(dpid, old_src, old_dst)
+                continue
+            rules.discard((old_src, old_dst))
+            evict.append((old_src, old_dst))
+        self._evicted += len(evict)
+        if len(heap) > 4 * len(rules) + 64:
+            self._heaps[dpid] = [entry for entry in heap if (entry[2], entry[3]) in rules]
+            heapq.heapify(self._heaps[dpid])
+        return evict
+
+    def flow_removed(self, dpid, src, dst, idle, packets, now):
+        """
+        Feedback from a FlowRemoved of one of our rules
+        Args:
+            dpid: the switch the rule was on
+            src, dst: the host pair of the rule
+            idle: True if the rule idled out
+            packets: how many packets the rule matched
+            now: when it was removed
+        """
+        self._rules[dpid].discard((src, dst))
+        state = self._pairs.get((src, dst))
+        if state is None or not idle:
+            return
+        state[2] = now
+        if packets <= 1:
+            state[1] = max(state[1] / 2, 1.0 / 8)
+
+    def table_sizes(self):
+        """
+        Returns: dict of dpid -> learning rules we have on the switch
+        """
+        return dict((dpid, len(rules)) for dpid, rules in self._rules.items())
+
+    def remove_switch(self, dpid):
+        self._rules.pop(dpid, None)
+        self._heaps.pop(dpid, None)
+
+    def _push(self, dpid, src, dst):
+        state = self._pairs.get((src, dst))
+        self._seq += 1
+        heapq.heappush(self._heaps[dpid], (state[0] if state else float("-inf"), self._seq, src, dst))
+
+    def _prune(self, now):
+        """
+        Forget the pairs that decayed away
+        """
+        cutoff = math.log(1e-3) + now / self.tau
+        for pair in [pair for pair, state in self._pairs.items() if state[0] < cutoff]:
+            del self._pairs[pair]
+        self._prune_at = max(10000, 2 * len(self._pairs))
+
+
+class RuleCompiler(object):
+    """
+    Compiles the per host pair path rules into fewer, wildcarded ones.
+
+    Shortest paths towards a destination form a tree, so on most switches
+    every source going to a destination leaves through the same port. Each
+    switch gets one destination only rule per destination, pointing at the
+    port the first path through it used, and only the pairs leaving
+    through another port get a (dl_src, dl_dst) rule of their own, with
+    in_port wildcarded. Table size goes from hosts squared towards hosts.
+
+    Only valid while the paths to a destination agree with each other on
+    where they go from a switch, which hop count and ecmp routing guarantee
+    but bandwidth routing, with weights changing under it, does not.
+    """
+    DEFAULT_PRIORITY = 90
+    EXACT_PRIORITY = 100
+
+    def __init__(self):
+        self._hops = defaultdict(dict)  # switch -> (src, dst) -> out_port of every installed path
+        self._dsts = defaultdict(dict)  # switch -> dst -> [out_port, sources it covers]
+        self._exceptions = defaultdict(set)  # switch -> (src, dst) with a rule of their own
+
+    def add(self, source, target, hops):
+        """
+        Compile a path, replacing whatever that pair had on those switches
+        Args:
+            source, target: the host pair
+            hops: (switch, in_port, out_port) as from SimpleController.path_hops
+        Returns: rules to send, as (switch, src or None, dst, out_port, command)
+        """
+        rules = []
+        for switch, in_port, out_port in hops:
+            rules.extend(self._set(switch, source, target, out_port))
+        return rules
+
+    def remove(self, source, target, switches):
+        """
+        Drop a pair's path from some switches
+        Returns: the rules to delete, as in add
+        """
+        rules = []
+        for switch in switches:
+            rules.extend(self._drop(switch, source, target))
+        return rules
+
+    def _set(self, switch, src, dst, out_port):
+        hops = self._hops[switch]
+        exceptions = self._exceptions[switch]
+        old = hops.get((src, dst))
+        if old == out_port:
+            return []
+        was_exception = (src, dst) in exceptions
+        hops[src, dst] = out_port
+        rules = []
+        entry = self._dsts[switch].get(dst)
+        if entry is None or entry[1] <= set([src]):
+            # nobody else uses this destination here, (re)point it
+            self._dsts[switch][dst] = [out_port, set([src])]
+            exceptions.discard((src, dst))
+            rules.append((switch, None, dst, out_port, of.OFPFC_ADD))
+        elif entry[0] == out_port:
+            entry[1].add(src)
+            exceptions.discard((src, dst))
+        else:
+            entry[1].discard(src)
+            exceptions.add((src, dst))
+            rules.append((switch, src, dst, out_port, of.OFPFC_ADD))
+        if was_exception and (src, dst) not in exceptions:
+            rules.append((switch, src, dst, None, of.OFPFC_DELETE_STRICT))
+        return rules
+
+    def _drop(self, switch, src, dst):
+        if self._hops[switch].pop((src, dst), None) is None:
+            return []
+        if (src, dst) in self._exceptions[switch]:
+            self._exceptions[switch].discard((src, dst))
+            return [(switch, src, dst, None, of.OFPFC_DELETE_STRICT)]
+        entry = self._dsts[switch][dst]
+        entry[1].discard(src)
+        if entry[1]:
+            return []
+        del self._dsts[switch][dst]
+        return [(switch, None, dst, None, of.OFPFC_DELETE_STRICT)]
+
+    def occupancy(self):
+        """
+        Returns: dict of switch -> (rules without compiling, rules with)
+        """
+        return dict((switch, (len(hops), len(self._dsts[switch]) + len(self._exceptions[switch])))
+                    for switch, hops in self._hops.items())
+
+    def rules(self, switch):
+        """
+        Every rule a switch should hold
+        Returns: list of (src or None, dst, out_port)
+        """
+        hops = self._hops.get(switch, {})
+        rules = [(None, dst, entry[0]) for dst, entry in self._dsts.get(switch, {}).items()]
+        rules.extend((src, dst, hops[src, dst]) for src, dst in self._exceptions.get(switch, ()))
+        return rules
+
+    def remove_switch(self, switch):
+        self._hops.pop(switch, None)
+        self._dsts.pop(switch, None)
+        self._exceptions.pop(switch, None)
+
+
+class PacketInLimiter(object):
+    """
+    Token bucket per (dpid, in_port) on the PacketIns we process, so a storm
+    of unknown destination traffic cannot take over the controller. A host
+    port that runs out of tokens gets a priority 0 drop rule on its in_port
+    with a short hard timeout. That rule sits under every learned and path
+    rule, so the port's known flows are still forwarded and only its table
+    misses, the PacketIns we would shed anyway, are dropped by the switch.
+    Ports between switches are only shed at the controller, a drop rule
+    there would also eat discovery's LLDP.
+    """
+    COOKIE = 0x5043  # tags our drop rules in FlowRemoved
+
+    def __init__(self, rate=100, burst=None, block=5):
+        """
+        Args:
+            rate: PacketIns per second a port gets processed
+            burst: PacketIns a port can send at once after being quiet,
+                twice the rate if None
+            block: seconds a port over its budget has its table misses dropped
+        """
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else 2 * rate)
+        self.block = int(block)
+        self._buckets = {}  # (dpid, port) -> [tokens, last refill]
+        self._blocked = {}  # (dpid, port) -> when its drop rule times out
+        self.shed = 0  # PacketIns we ignored
+        self.dropped = 0  # packets drop rules discarded, from FlowRemoved
+        self.blocks = 0  # drop rules installed
+
+    def allow(self, event, now):
+        """
+        Take a token for a PacketIn
+        Returns: False if the port is over its budget and the PacketIn
+        should be ignored
+        """
+        key = (event.dpid, event.port)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            return True
+        bucket[0] = tokens
+        self.shed += 1
+        if self._blocked.get(key, 0) <= now and core.openflow_discovery.is_edge_port(event.dpid, event.port):
+            self._block(event, key, now)
+        return False
+
+    def _block(self, event, key, now):
+        msg = of.ofp_flow_mod()
+        msg.match.in_port = event.port
+        msg.priority = 0
+        msg.cookie = self.COOKIE
+        msg.hard_timeout = self.block
+        msg.flags = of.OFPFF_SEND_FLOW_REM
+        event.connection.send(msg)
+        self._blocked[key] = now + self.block
+        self.blocks += 1
+        log.warning("Port %s.%i is over %g PacketIns/s, dropping its table misses for %is",
+                    dpid_to_str(event.dpid), event.port, self.rate, self.block)
+
+    def flow_removed(self, packets):
+        """
+        One of our drop rules timed out having dropped packets
+        """
+        self.dropped += packets
+
+    def remove_switch(self, dpid):
+        for key in [key for key in self._buckets if key[0] == dpid]:
+            del self._buckets[key]
+            self._blocked.pop(key, None)
@@ -0,0 +1,192 @@
+"""
+Controller instrumentation for the PyThess controller, exported in the
+Prometheus text format on a local HTTP endpoint.
+"""
+
+import bisect
+import threading
+import time
+from collections import defaultdict
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from pox.core import core
+import pox.lib.util as poxutil
+from pox.lib.recoco import Timer
+log = core.getLogger()
+
+
+class Histogram(object):
+    """
+    Latency histogram with fixed buckets, from 10us to 1s
+    """
+    BOUNDS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1,
+              0.25, 0.5, 1.0)
+
+    __slots__ = ("counts", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)  # the last bucket is +Inf
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BOUNDS, seconds)] += 1
+        self.total += seconds
+
+    def time(self):
+        """
+        Context manager observing how long its block took
+        """
+        return _Timing(self)
+
+
+class _Timing(object):
+    __slots__ = ("histogram", "started")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.time()
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.time() - self.started)
+        return False
+
+
+class Metrics(object):
+    """
+    Counters, handler latency histograms and the PacketIn rate of every
+    switch. Everything is updated from the POX thread with plain dict and
+    list operations, export only takes copies so it can run on another
+    thread.
+    """
+    def __init__(self, rate_interval=5.0):
+        """
+        Args:
+            rate_interval: seconds over which PacketIn rates are averaged
+        """
+        self.counters = defaultdict(int)  # (name, kind) -> count
+        self.histograms = {}  # handler -> Histogram
+        self.packet_ins = defaultdict(int)  # dpid -> PacketIns so far
+        self.packet_in_rate = {}  # dpid -> PacketIns per second over the last interval
+        self._gauges = []  # (name, help, function returning the value)
+        self._last_packet_ins = {}
+        self._last_time = time.time()
+        self._timer = Timer(rate_interval, self._update_rates, recurring=True)
+
+    def count(self, name, kind, n=1):
+        self.counters[name, kind] += n
+
+    def histogram(self, handler):
+        histogram = self.histograms.get(handler)
+        if histogram is None:
+            histogram = self.histograms[handler] = Histogram()
+        return histogram
+
+    def time(self, handler):
+        """
+        Context manager adding how long its block took to a handler's histogram
+        """
+        return self.histogram(handler).time()
+
+    def timed(self, handler, function):
+        """
+        Wrap an event handler so every call lands in its histogram
+        """
+        histogram = self.histogram(handler)
+
+        def timed_handler(*args, **kwargs):
+            started = time.time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.time() - started)
+        return timed_handler
+
+    def gauge(self, name, help, function):
+        """
+        Export the value of function() as a gauge, read on every export
+        """
+        self._gauges.append((name, help, function))
+
+    def remove_switch(self, dpid):
+        self.packet_ins.pop(dpid, None)
+        self.packet_in_rate.pop(dpid, None)
+        self._last_packet_ins.pop(dpid, None)
+
+    def _update_rates(self):
+        now = time.time()
+        elapsed = now - self._last_time
+        self._last_time = now
+        if elapsed <= 0:
+            return
+        for dpid, total in list(self.packet_ins.items()):
+            self.packet_in_rate[dpid] = (total - self._last_packet_ins.get(dpid, 0)) / elapsed
+            self._last_packet_ins[dpid] = total
+
+    def render(self):
+        """
+        Everything in the Prometheus text format
+        """
+        lines = ["# HELP pythess_packet_in_total PacketIns received per switch",
+                 "# TYPE pythess_packet_in_total counter"]
+        for dpid, total in sorted(self.packet_ins.copy().items()):
+            lines.append('pythess_packet_in_total{dpid="%s"} %d' % (poxutil.dpid_to_str(dpid), total))
+        lines += ["# HELP pythess_packet_in_rate PacketIns per second per switch",
+                  "# TYPE pythess_packet_in_rate gauge"]
+        for dpid, rate in sorted(self.packet_in_rate.copy().items()):
+            lines.append('pythess_packet_in_rate{dpid="%s"} %.3f' % (poxutil.dpid_to_str(dpid), rate))
+
+        counters = defaultdict(list)
+        for (name, kind), value in self.counters.copy().items():
+            counters[name].append((kind, value))
+        for name, values in sorted(counters.items()):
+            lines.append("# TYPE pythess_%s_total counter" % name)
+            for kind, value in sorted(values):
+                lines.append('pythess_%s_total{kind="%s"} %d' % (name, kind, value))
+
+        lines += ["# HELP pythess_handler_seconds Time spent in controller handlers",
+                  "# TYPE pythess_handler_seconds histogram"]
+        for handler, histogram in sorted(self.histograms.copy().items()):
+            counts = list(histogram.counts)
+            cumulative = 0
+            for bound, count in zip(Histogram.BOUNDS + ("+Inf",), counts):
+                cumulative += count
+                lines.append('pythess_handler_seconds_bucket{handler="%s",le="%s"} %d' % (handler, bound, cumulative))
+            lines.append('pythess_handler_seconds_sum{handler="%s"} %.6f' % (handler, histogram.total))
+            lines.append('pythess_handler_seconds_count{handler="%s"} %d' % (handler, cumulative))
+
+        for name, help, function in self._gauges:
+            lines += ["# HELP pythess_%s %s" % (name, help), "# TYPE pythess_%s gauge" % name,
+                      "pythess_%s %s" % (name, function())]
+        return "\n".join(lines) + "\n"
+
+
+class MetricsServer(object):
+    """
+    Serves Metrics.render() on http://host:port/metrics from a daemon thread
+    """
+    def __init__(self, metrics, port, host="127.0.0.1"):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                log.debug("metrics %s - %s", self.client_address[0], format % args)
+
+        self.server = HTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self.server.serve_forever, name="metrics")
+        self._thread.daemon = True
+        self._thread.start()
+        log.info("Metrics on http://%s:%i/metrics", host, self.server.server_address[1])
@@ -18,18 +18,29 @@ each pair of L2 addresses.
 """
 
 # These next two imports are common POX convention
-from collections import Counter, defaultdict
+from collections import defaultdict
+import heapq
+import logging
 import networkx as nx
 import time
-import threading
 from pox.core import core
 import pox.openflow.discovery
 import pox.host_tracker
 import pox.openflow.spanning_tree as spanning_tree
 import pox.openflow.libopenflow_01 as of
 import pox.lib.util as poxutil  # handle args on initial launch
+from pox.lib.packet.ethernet import ethernet
 from pox.lib.recoco import Timer
 from pox.openflow.of_json import *
+from arp import ArpProxy, NdpProxy, ip6_to_int
+from checkpoint import Checkpointer
+from cluster import ClusterBus, Membership, parse_members
+from failover import BackupPaths
+from flows import FlowLifetimeManager, PacketInLimiter, ProactiveInstaller, RuleCompiler
+from metrics import Metrics, MetricsServer
+from routing import CongestionAwareRouting, EqualCostMultipath
+from stats import BandwidthEstimator, FlowStatsCollector, StatsScheduler
+from topology import AddressIndex, PathTable, TopologyStore, int_to_mac, mac_to_int
 log = core.getLogger()
 
 
@@ -37,21 +48,59 @@ class SimpleController(object):
     """
     This is the controller class. Register on launch
     """
-    def __init__(self):
+    def __init__(self, stats_budget=100, stats_interval=1.0, routing="hops", link_capacity=1000,
+                 ecmp_paths=4, proactive=False, proactive_rate=50, flow_table_size=1000,
+                 aggregate_flows=False, arp_proxy=False, arp_max_age=300, metrics_port=0,
+                 packet_in_limit=0, packet_in_block=5, checkpoint="", checkpoint_interval=30,
+                 top_flows=0, cluster="", cluster_id=0, ipv6=True):
+        # counters and handler latencies, served on metrics_port if set
+        self.metrics = Metrics()
+        # several controllers on one fabric, each handling the switches it
+        # owns and sharing links and hosts with the others over the bus,
+        # which starts at the end of __init__
+        self.cluster = None
+        self.membership = None
+        self._owned = set()  # connected switches we own
+        members = parse_members(cluster) if cluster else None
+        if members:
+            self.membership = Membership(len(members), cluster_id)
+        # hosts and switches are nodes numbered by self.addresses, the
+        # dicts below are keyed by node and the topology graph is made of them
+        self.addresses = AddressIndex()
         self.switch_links_to_port = {}
-        self.paths_applied = {}
+        # installed paths with the topology version each went in on, a path
+        # from an older version is routed again on the pair's next PacketIn
+        self.paths_applied = PathTable()
+        self._swept_version = None
+        Timer(5, self.sweep_paths, recurring=True)
+        # a link disjoint backup for every path in paths_applied, computed
+        # in the background, so a link going down is failed over at once
+        self.backups = BackupPaths()
+        Timer(0.5, self.compute_backups, recurring=True)
         self.spanning_tree = {}  # the spanning tree in case we have loops
-        self.mac_to_port = {}
-        self.topology = nx.Graph()
+        self.mac_to_port = {}  # host -> port on its switch
+        # versioned copy-on-write topology, changed only by its writer thread
+        self.topology_store = TopologyStore()
         self.loop = []
 
-        # This table maps (switch,MAC-addr) pairs to the port on 'switch' at
-        # which we last saw a packet *from* 'MAC-addr'.
-        # (In this case, we use a Connection object for the switch.)
-        self.table = {}
-
-        self.ip_to_mac = {}
-        self.traffic_pair_counter = Counter()
+        # This table maps switch dpid -> MAC -> the port on the switch at
+        # which we last saw a packet *from* that MAC, both as ints.
+        self.table = defaultdict(dict)
+
+        self.ip_to_mac = {}  # IPv4 -> MAC, both as ints
+        self.ip6_to_mac = {}  # IPv6 -> MAC, both as ints
+        # IPv6 is forwarded like IPv4, or dropped by a rule on every switch
+        self.ipv6 = ipv6
+        # PacketIns processed per second and port, the excess is shed
+        self.limiter = None
+        if packet_in_limit:
+            self.limiter = PacketInLimiter(rate=packet_in_limit, block=packet_in_block)
+        # answer ARP requests from the controller, flood only the misses
+        self.arp = ArpProxy(max_age=arp_max_age) if arp_proxy else None
+        # and IPv6 neighbor solicitations the same way
+        self.ndp = NdpProxy(max_age=arp_max_age) if arp_proxy and ipv6 else None
+        # timeouts of the learned rules from decaying per pair PacketIn rates
+        self.flow_lifetime = FlowLifetimeManager(table_size=flow_table_size)
         # To send out all ports, we can use either of the special ports
         # OFPP_FLOOD or OFPP_ALL.  We'd like to just use OFPP_FLOOD,
         # but it's not clear if all switches support this, so we make
@@ -59,27 +108,142 @@ class SimpleController(object):
         self.all_ports = of.OFPP_FLOOD
 
         # bandwidth variables START--------------------------------------------------------->
-        self.switches_bw = defaultdict(lambda: defaultdict(int))  # holds switches ports last seen bytes
+        self.bandwidth = BandwidthEstimator()  # rate of every (dpid, port) in bits per second
         # bandwidth variables END----------------------------------------------------------->
 
+        # one scheduler polls every switch, staggered and within a request budget
+        self.stats_scheduler = StatsScheduler(budget=stats_budget, min_interval=stats_interval)
+        # elephant flows of every switch from flow stats, one port's slice of
+        # its table per poll
+        self.flow_stats = None
+        if top_flows:
+            self.flow_stats = FlowStatsCollector(k=top_flows)
+            self.stats_scheduler.requests.append(self.flow_stats.request)
+
+        # "hops" routes on hop count, "bandwidth" on measured link utilization
+        # and "ecmp" spreads host pairs over the equal cost paths
+        self.congestion = None
+        self.ecmp = None
+        if routing == "bandwidth":
+            self.congestion = CongestionAwareRouting(self, capacity=link_capacity)
+        elif routing == "ecmp":
+            self.ecmp = EqualCostMultipath(k=ecmp_paths)
+
+        # path rules aggregated per destination instead of one per host pair
+        self.rule_compiler = None
+        if aggregate_flows and self.congestion is not None:
+            log.warning("aggregate_flows needs consistent shortest path trees, not with bandwidth routing")
+        elif aggregate_flows:
+            self.rule_compiler = RuleCompiler()
+            Timer(60, self.log_flow_table_occupancy, recurring=True)
+
+        # install the paths to a host as soon as host_tracker finds it
+        self.proactive = None
+        if proactive:
+            self.proactive = ProactiveInstaller(self, rate=proactive_rate)
+
         # get stats START ------------------------------------------------------------------>
-        # core.openflow.addListenerByName("FlowStatsReceived", self._handle_flowstats_received)
+        core.openflow.addListenerByName("FlowStatsReceived", self._handle_flowstats_received)
         core.openflow.addListenerByName("PortStatsReceived", self._handle_portstats_received)
         core.openflow.addListenerByName("QueueStatsReceived", self._handle_qeuestats_received)
         # get stats END -------------------------------------------------------------------->
-        core.openflow.addListenerByName("PacketIn", self._handle_PacketIn)
+        core.openflow.addListenerByName("PacketIn", self.metrics.timed("packet_in", self._handle_PacketIn))
         core.openflow.addListenerByName("ConnectionUp", self._handle_ConnectionUp)
+        core.openflow.addListenerByName("ConnectionDown", self._handle_ConnectionDown)
+        core.openflow.addListenerByName("FlowRemoved", self._handle_FlowRemoved)
         core.openflow_discovery.addListenerByName("LinkEvent", self._handle_LinkEvent)  # listen to openflow_discovery
         core.host_tracker.addListenerByName("HostEvent", self._handle_HostEvent)  # listen to host_tracker
 
+        # state saved to disk and loaded back, so a restart does not relearn
+        # everything by flooding
+        self.checkpointer = None
+        if checkpoint:
+            self.checkpointer = Checkpointer(self, checkpoint, interval=checkpoint_interval)
+            self.checkpointer.load()
+
+        self.metrics.gauge("topology_version", "Topology versions published so far",
+                           lambda: self.topology_version)
+        self.metrics.gauge("topology_nodes", "Switches and hosts in the topology",
+                           lambda: len(self.topology))
+        self.metrics.gauge("paths_applied", "Host to host paths installed", lambda: len(self.paths_applied))
+        if self.ecmp is not None:
+            self.metrics.gauge("ecmp_cache_hits", "Equal cost path lookups answered from the cache",
+                               lambda: self.ecmp.hits)
+            self.metrics.gauge("ecmp_cache_misses", "Equal cost path lookups that enumerated the paths",
+                               lambda: self.ecmp.misses)
+        if self.arp is not None:
+            self.metrics.gauge("arp_answered", "ARP requests answered by the controller",
+                               lambda: self.arp.answered)
+            self.metrics.gauge("arp_flooded", "ARP requests flooded on a cache miss", lambda: self.arp.missed)
+        if self.ndp is not None:
+            self.metrics.gauge("ndp_answered", "Neighbor solicitations answered by the controller",
+                               lambda: self.ndp.answered)
+            self.metrics.gauge("ndp_flooded", "Neighbor solicitations flooded on a cache miss",
+                               lambda: self.ndp.missed)
+        self.metrics.gauge("backup_paths", "Installed paths with a link disjoint backup ready",
+                           self.backups.covered)
+        if self.limiter is not None:
+            self.metrics.gauge("packet_in_shed", "PacketIns ignored over the per port budget",
+                               lambda: self.limiter.shed)
+            self.metrics.gauge("packet_in_dropped", "Table misses dropped by the switches' rate limit rules",
+                               lambda: self.limiter.dropped)
+            self.metrics.gauge("packet_in_blocks", "Rate limit drop rules installed", lambda: self.limiter.blocks)
+        if metrics_port:
+            self.metrics_server = MetricsServer(self.metrics, metrics_port)
+
+        # only now that the checkpoint is in, a peer's links and hosts would
+        # otherwise be numbered before the checkpoint's and clash with them
+        if members:
+            self.cluster = ClusterBus(members, cluster_id,
+                                      lambda message: core.callLater(self._handle_cluster_message, message))
+            Timer(1.0, self.cluster_heartbeat, recurring=True)
+            Timer(30, self.cluster_sync, recurring=True)
+
+    @property
+    def topology(self):
+        """
+        The current topology graph, frozen. Take it once and work on that
+        rather than reading self.topology again, it may be a newer version.
+        """
+        return self.topology_store.graph
+
+    @property
+    def topology_version(self):
+        return self.topology_store.version
+
     def _handle_qeuestats_received (self, event):
         """
         handler to manage queued packets statistics received
         Args:
             event: Event listening to QueueStatsReceived from openflow
         """
-        stats = flow_stats_to_list(event.stats)
-        # log.info("QueueStatsReceived from %s: %s", dpidToStr(event.connection.dpid), stats)
+        # log.info("QueueStatsReceived from %s: %i queues", dpidToStr(event.connection.dpid), len(event.stats))
+
+    def _handle_flowstats_received(self, event):
+        """
+        Handler to manage flow statistics received, a slice of the flow table
+        Args:
+            event: Event listening to FlowStatsReceived from openflow
+        """
+        if self.flow_stats is not None:
+            self.flow_stats.update(event.connection.dpid, event.stats, time.time())
+
+    def busiest_flows(self, k=10):
+        """
+        The k busiest flows over all switches, a flow crossing several
+        switches counted once at its busiest
+        Returns: list of (src MAC or None, dst MAC, bits per second), busiest
+        first, MACs as strings
+        """
+        if self.flow_stats is None:
+            return []
+        flows = {}
+        for dpid in self.flow_stats.switches():
+            for flow, rate in self.flow_stats.top(dpid, k):
+                flows[flow] = max(rate, flows.get(flow, 0.0))
+        busiest = heapq.nlargest(k, flows.items(), key=lambda item: item[1])
+        return [(None if src is None else str(int_to_mac(src)), str(int_to_mac(dst)), rate)
+                for (src, dst), rate in busiest]
 
     def _handle_portstats_received(self,event):
         """
@@ -87,32 +251,28 @@ class SimpleController(object):
         Args:
             event: Event listening to PortStatsReceived from openflow
         """
-        for f in event.stats:
-            if int(f.port_no)<65534: # used from hosts and switches interlinks
-                current_bytes = f.rx_bytes + f.tx_bytes  # transmitted and received
-                try:
-                    last_bytes = self.switches_bw[int(event.connection.dpid)][int(f.port_no)]
-                except:
-                    last_bytes = 0
-                estim_bw = (((current_bytes - last_bytes)/1024)/1024)*8
-                estim_bw = float(format(estim_bw, '.2f'))
-                if estim_bw > 0:
-                    print pox.lib.util.dpidToStr(event.connection.dpid), f.port_no, estim_bw
-
-                self.switches_bw[int(event.connection.dpid)][int(f.port_no)] = (f.rx_bytes + f.tx_bytes)
-
-    def _timer_func (self):
+        # used from hosts and switches interlinks, transmitted and received
+        counters = [(f.port_no, f.rx_bytes + f.tx_bytes) for f in event.stats if f.port_no < of.OFPP_MAX]
+        now = time.time()
+        rates = self.bandwidth.update(event.connection.dpid, counters, now)
+        self.stats_scheduler.report_activity(event.connection.dpid, rates.any())
+        if self.congestion is not None:
+            # each direction of the links on its own, for utilization
+            directions = [(f.port_no, f.rx_bytes, f.tx_bytes) for f in event.stats if f.port_no < of.OFPP_MAX]
+            self.congestion.port_stats(event.connection.dpid, directions, now)
+
+    def busiest_links(self, k=10):
         """
-        Recurring function to request stats from switches
-        for each connection (which represents a switch actually)
-        request statistics
+        The k busiest switch to switch links by measured bandwidth
+        Args:
+            k: how many links to return
+        Returns: list of (switch, next switch, bits per second), busiest first,
+        switches as dpid strings
         """
-        for connection in core.openflow._connections.values():
-            # connection.send(of.ofp_stats_request(body=of.ofp_flow_stats_request()))
-
-            connection.send(of.ofp_stats_request(body=of.ofp_port_stats_request()))
-            connection.send(of.ofp_stats_request(body=of.ofp_queue_stats_request()))
-        # log.info("Sent %i flow/port stats request(s)", len(core.openflow._connections))
+        name = self.addresses.name
+        links = [(name(s1), name(s2), self.bandwidth.rate(self.addresses.address(s1), p1))
+                 for (s1, s2), (p1, p2) in self.switch_links_to_port.items()]
+        return heapq.nlargest(k, links, key=lambda link: link[2])
 
     def _handle_ConnectionUp(self, event):
         """
@@ -123,73 +283,314 @@ class SimpleController(object):
         Returns:
 
         """
-        self.topology.add_node(pox.lib.util.dpid_to_str(event.dpid))
-        Timer(1, self._timer_func, recurring=True)
+        self.topology_store.submit(self.add_switch_to_topology, self.addresses.switch(event.dpid))
+        if not self.ipv6:
+            self.drop_ipv6(event.connection)
+        if self.owns(event.dpid):
+            self._owned.add(event.dpid)
+            self.stats_scheduler.add_switch(event.dpid)
         # print self.topology.nodes()
-        self.switches_bw[int(event.dpid)] = {}
+
+    def drop_ipv6(self, connection):
+        """
+        Drop every IPv6 packet on a switch, above the path and learned rules
+        that would otherwise forward it between hosts they match on MACs
+        Args:
+            connection: the switch's connection
+        """
+        msg = of.ofp_flow_mod()
+        msg.match.dl_type = ethernet.IPV6_TYPE
+        msg.priority = 200
+        connection.send(msg)
+
+    def _handle_ConnectionDown(self, event):
+        """
+        The switch disconnected, stop polling it for stats
+        Args:
+            event: ConnectionDown from openflow
+        """
+        self._owned.discard(event.dpid)
+        self.stats_scheduler.remove_switch(event.dpid)
+        self.bandwidth.remove_switch(event.dpid)
+        if self.congestion is not None:
+            self.congestion.remove_switch(event.dpid)
+        if self.flow_stats is not None:
+            self.flow_stats.remove_switch(event.dpid)
+        self.flow_lifetime.remove_switch(event.dpid)
+        self.metrics.remove_switch(event.dpid)
+        if self.limiter is not None:
+            self.limiter.remove_switch(event.dpid)
+        self.table.pop(event.dpid, None)
+        if self.rule_compiler is not None:
+            self.rule_compiler.remove_switch(self.addresses.switch(event.dpid))
+
+    def _handle_FlowRemoved(self, event):
+        """
+        A rule expired or was deleted, feed it back to the flow timeouts
+        Args:
+            event: FlowRemoved from openflow
+        """
+        if event.ofp.cookie == PacketInLimiter.COOKIE and self.limiter is not None:
+            self.limiter.flow_removed(event.ofp.packet_count)
+            return
+        if event.ofp.priority != 1:
+            return  # not a rule learned in _handle_PacketIn
+        match = event.ofp.match
+        self.flow_lifetime.flow_removed(event.dpid, mac_to_int(match.dl_src), mac_to_int(match.dl_dst),
+                                        event.idleTimeout, event.ofp.packet_count, time.time())
 
     def _handle_LinkEvent(self, event):
         """
         Listen to link events between our network components. Specifically
-        interested in links between switches at the moment. Each time such
-        event occurs we pass arguments in a threaded function to run async
+        interested in links between switches at the moment. In a cluster
+        only the owner of the first switch takes the event and shares it
         Args:
             event: LinkEvent listening to openflow.discovery
         Returns: Nothing at the moment, saves topology graph and spanning tree
         """
-        s1 = pox.lib.util.dpid_to_str(event.link.dpid1)  # the first switch in the link event
-        s2 = pox.lib.util.dpid_to_str(event.link.dpid2)  # the second switch in the link event
-        p1, p2 = event.link.port1, event.link.port2  # the port fo the first switch
+        link = event.link
+        if not self.owns(link.dpid1):
+            return
+        self.link_changed(link.dpid1, link.port1, link.dpid2, link.port2, event.removed)
+        if self.cluster is not None:
+            self.cluster.send({"type": "links",
+                               "links": [(link.dpid1, link.port1, link.dpid2, link.port2, event.removed)]})
+
+    def link_changed(self, dpid1, p1, dpid2, p2, removed):
+        """
+        A link came up or went down. Each time it happens we queue the change
+        to the topology writer thread
+        Args:
+            dpid1, p1: the switch and port the link leaves from
+            dpid2, p2: the switch and port it arrives at
+            removed: whether the link went down
+        """
+        s1 = self.addresses.switch(dpid1)  # the first switch in the link event
+        s2 = self.addresses.switch(dpid2)  # the second switch in the link event
+        if removed:
+            self.fail_over(s1, s2, dpid1, p1)
+            self.switch_links_to_port.pop((s1, s2), None)
+            self.topology_store.submit(self.link_removed_from_topology, s1, s2)
+            return
         self.switch_links_to_port[s1, s2] = (p1, p2)
-        print self.switch_links_to_port
-        ltrt = threading.Thread(target=self.link_event_to_topology, args=(s1, s2))
-        ltrt.start()
+        self.backups.link_up(s1, s2)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Link %s.%i -> %s.%i", self.addresses.name(s1), p1, self.addresses.name(s2), p2)
+        self.topology_store.submit(self.link_event_to_topology, s1, s2)
+
+    def fail_over(self, s1, s2, dpid, port):
+        """
+        A link went down. Every path crossing it moves to its backup, or is
+        deleted to be computed again on its next PacketIn if it had none,
+        and the learned rules still sending out of the dead port are deleted.
+        Args:
+            s1, s2: the switch nodes of the link
+            dpid, port: the switch port the link left from
+        """
+        with self.metrics.time("fail_over"):
+            moves = self.backups.link_down(s1, s2)
+            for pair, old_path, new_path in moves:
+                if new_path is None:
+                    self.forget_path(old_path)
+                else:
+                    self.reroute_path(old_path, new_path)
+            con = core.openflow.getConnection(dpid)
+            if con is not None and self.owns(dpid):
+                con.send(of.ofp_flow_mod(command=of.OFPFC_DELETE, out_port=port))
+        self.metrics.count("failover_paths", "moved", sum(1 for move in moves if move[2] is not None))
+        self.metrics.count("failover_paths", "dropped", sum(1 for move in moves if move[2] is None))
+        log.info("Link %s -> %s down, %i paths failed over", self.addresses.name(s1),
+                 self.addresses.name(s2), len(moves))
+
+    def compute_backups(self):
+        """
+        Compute some of the missing backup paths on the current topology
+        """
+        self.backups.compute(self.topology, budget=20)
+
+    def sweep_paths(self):
+        """
+        Remove the installed paths a topology change broke, once per version
+        """
+        snapshot = self.topology_store.current
+        if snapshot.version == self._swept_version:
+            return
+        self._swept_version = snapshot.version
+        for path in self.paths_applied.sweep(snapshot.graph, snapshot.version):
+            self.forget_path(path)
+            self.metrics.count("paths", "swept")
 
-    def link_event_to_topology(self, s1, s2):
+    def add_switch_to_topology(self, graph, s):
+        """
+        Topology change adding a switch that connected
+        Args:
+            graph: the next version of the topology
+            s: the switch node
+        """
+        graph.add_node(s)
+
+    def link_event_to_topology(self, graph, s1, s2):
         """
         Add switches to networkx topology graph and check for loops
         if our topology contains loops we calculate the spanning tree
         to be used for the first packets when destination will be unknown
         Args:
-            s1: first switch in the link ex. "00-00-00-00-00-01"
-            s2: second switch in the link ex. "00-00-00-00-00-02"
+            graph: the next version of the topology
+            s1: first switch node in the link
+            s2: second switch node in the link
         Returns: nada
         """
-        self.topology.add_edge(s1, s2, weight=100)  # the port of the second switch
+        graph.add_edge(s1, s2, weight=100)  # the port of the second switch
         try:
-            self.loop = nx.cycle_basis(self.topology)[0]
+            self.loop = nx.cycle_basis(graph)[0]
             self.spanning_tree = spanning_tree._calc_spanning_tree()
         except:
             self.loop = []
 
+    def link_removed_from_topology(self, graph, s1, s2):
+        """
+        Topology change removing a link that went down
+        Args:
+            graph: the next version of the topology
+            s1: first switch node in the link
+            s2: second switch node in the link
+        """
+        if graph.has_edge(s1, s2):
+            graph.remove_edge(s1, s2)
+        cycles = nx.cycle_basis(graph)
+        self.loop = cycles[0] if cycles else []
+
     def _handle_HostEvent(self, event):
         """
         Listen to host_tracker events, fired up every time a host is up or down
         When this happens we need the topology. For now must issue a pingall from
         mininet cli. Later to fire own pings?
-        To handle topology a thread is launched with arguments the host and the switch
+        In a cluster only the owner of the host's switch takes the event and
+        shares it
         Args:
             event: HostEvent listening to core.host_tracker
         Returns: nada
         """
-        macaddr = event.entry.macaddr.toStr()
-        s = pox.lib.util.dpid_to_str(event.entry.dpid)
-        self.mac_to_port[macaddr] = event.entry.port
+        entry = event.entry
+        if not self.owns(entry.dpid):
+            return
+        mac = mac_to_int(entry.macaddr)
+        self.host_seen(mac, entry.dpid, entry.port, event.join or event.move)
+        if self.cluster is not None:
+            self.cluster.send({"type": "hosts", "hosts": [(mac, entry.dpid, entry.port)]})
+
+    def host_seen(self, mac, dpid, port, joined=False):
+        """
+        A host was found on a switch port. The host and its switch are
+        queued to the topology writer thread
+        Args:
+            mac: the host's MAC as an int
+            dpid, port: where it is
+            joined: whether it is new there, for proactive installs
+        """
+        macaddr = self.addresses.host(mac)
+        s = self.addresses.switch(dpid)
+        self.mac_to_port[macaddr] = port
         # time.sleep(5)
-        htrt = threading.Thread(target=self.add_host_to_topology, args=(s, macaddr))
-        htrt.start()
+        self.topology_store.submit(self.add_host_to_topology, s, macaddr)
+        if self.proactive is not None and joined:
+            self.proactive.host_joined(macaddr, self.mac_to_port.keys())
+
+    def owns(self, dpid):
+        """
+        Whether we handle the switch, always unless we run in a cluster
+        """
+        return self.membership is None or self.membership.owns(dpid)
+
+    def _handle_cluster_message(self, message):
+        """
+        A message from another controller of the cluster, on the POX thread
+        """
+        sender = message["from"]
+        if self.membership.heard(sender, time.time()):
+            log.info("Controller %i joined the cluster", sender)
+            self.ownership_changed()
+            self.cluster_sync(sender)
+        kind = message.get("type")
+        # a sync repeats what we mostly know already, only news changes the topology
+        if kind == "links":
+            for dpid1, p1, dpid2, p2, removed in message["links"]:
+                if not self.knows_link(dpid1, p1, dpid2, p2, removed):
+                    self.link_changed(dpid1, p1, dpid2, p2, removed)
+        elif kind == "hosts":
+            for mac, dpid, port in message["hosts"]:
+                if not self.knows_host(mac, dpid, port):
+                    self.host_seen(mac, dpid, port)
+
+    def knows_link(self, dpid1, p1, dpid2, p2, removed):
+        """
+        Whether a link is already up on these ports, or already down
+        """
+        ports = self.switch_links_to_port.get((self.addresses.switch(dpid1), self.addresses.switch(dpid2)))
+        return ports is None if removed else ports == (p1, p2)
 
-    def add_host_to_topology(self, s, macaddr):
+    def knows_host(self, mac, dpid, port):
+        """
+        Whether a host is already known on this switch port
         """
-        Handle graph related methods with async Timer
+        host = self.addresses.find_host(mac)
+        if host is None or self.mac_to_port.get(host) != port:
+            return False
+        return self.topology.has_edge(host, self.addresses.switch(dpid))
+
+    def cluster_heartbeat(self):
+        self.cluster.send({"type": "hello"})
+        dead = self.membership.expire(time.time())
+        if dead:
+            log.warning("Controllers %s left the cluster, taking over their switches", dead)
+            self.ownership_changed()
+
+    def ownership_changed(self):
+        """
+        The cluster changed, start or stop polling the switches that moved
+        """
+        owned = set(con.dpid for con in core.openflow.connections if self.owns(con.dpid))
+        for dpid in owned - self._owned:
+            self.stats_scheduler.add_switch(dpid)
+        for dpid in self._owned - owned:
+            self.stats_scheduler.remove_switch(dpid)
+        log.info("Owning %i switches, %i taken over, %i handed off", len(owned), len(owned - self._owned),
+                 len(self._owned - owned))
+        self._owned = owned
+
+    def cluster_sync(self, to=None):
+        """
+        Send the links and hosts of our switches to the other controllers, so
+        a controller that joined or missed a message catches up
         Args:
-            s: the switch
-            macaddr: the host
+            to: the controller to send to, None for all
+        """
+        address = self.addresses.address
+        links = [(address(s1), p1, address(s2), p2, False)
+                 for (s1, s2), (p1, p2) in self.switch_links_to_port.items() if self.owns(address(s1))]
+        topology = self.topology
+        hosts = []
+        for host, port in self.mac_to_port.items():
+            switches = list(topology.neighbors(host)) if host in topology else []
+            if switches and self.owns(address(switches[0])):
+                hosts.append((address(host), address(switches[0]), port))
+        for i in range(0, len(links), 200):
+            self.cluster.send({"type": "links", "links": links[i:i + 200]}, to)
+        for i in range(0, len(hosts), 200):
+            self.cluster.send({"type": "hosts", "hosts": hosts[i:i + 200]}, to)
+
+    def add_host_to_topology(self, graph, s, macaddr):
+        """
+        Topology change adding a host and its link to the switch
+        Args:
+            graph: the next version of the topology
+            s: the switch node
+            macaddr: the host node
         Returns: nada
         """
         # time.sleep(5)
-        self.topology.add_node(macaddr)
-        self.topology.add_edge(s, macaddr, weight=10)
+        graph.add_node(macaddr)
+        graph.add_edge(s, macaddr, weight=10)
         # print self.topology.edges(data=True)
         # print self.topology.nodes(data=True)
 
@@ -201,13 +602,22 @@ class SimpleController(object):
             event: event parsed from PacketIn
         Returns: nada
         """
+        if self.membership is not None and not self.membership.owns(event.dpid):
+            return  # another controller of the cluster handles this switch
+        self.metrics.packet_ins[event.dpid] += 1
+        if self.limiter is not None and not self.limiter.allow(event, time.time()):
+            return
         packet = event.parsed
+        src = mac_to_int(packet.src)
+        dst = mac_to_int(packet.dst)
 
         # Learn the source
-        self.table[(event.connection,packet.src)] = event.port
-        if packet.type == packet.IPV6_TYPE:
+        ports = self.table[event.dpid]
+        ports[src] = event.port
+        if packet.type == packet.IPV6_TYPE and not self.ipv6:
+            # only until the switch has our drop rule, release the buffer
             msg = of.ofp_packet_out()
-            msg.buffer_id = None
+            msg.buffer_id = event.ofp.buffer_id
             msg.in_port = event.port
             event.connection.send(msg)
             return
@@ -215,15 +625,31 @@ class SimpleController(object):
         if not packet.parsed:
             log.warning("Ignoring incomplete packet")
             return
+        if packet.type == packet.ARP_TYPE and self.arp is not None:
+            if self.arp.handle(event, packet, time.time()):
+                return
         if packet.type == 2048:
             pkt = packet.find('ipv4')
-            self.ip_to_mac[pkt.srcip.toStr()] = packet.src
-            self.ip_to_mac[pkt.dstip.toStr()] = packet.dst
-            self.traffic_pair_counter[packet.src, packet.dst] += 1
-        dst_port = self.table.get((event.connection, packet.dst))
+            now = time.time()
+            self.ip_to_mac[pkt.srcip.toUnsigned()] = src
+            self.ip_to_mac[pkt.dstip.toUnsigned()] = dst
+            if self.arp is not None:
+                self.arp.learn(pkt.srcip.toUnsigned(), src, now)
+            self.flow_lifetime.packet_in(src, dst, now)
+        elif packet.type == packet.IPV6_TYPE:
+            pkt = packet.find('ipv6')
+            now = time.time()
+            if pkt is not None:
+                srcip = ip6_to_int(pkt.srcip)
+                if srcip:  # :: while the host checks its address is free
+                    self.ip6_to_mac[srcip] = src
+            if self.ndp is not None and self.ndp.handle(event, packet, now):
+                return
+            self.flow_lifetime.packet_in(src, dst, now)
+        dst_port = ports.get(dst)
 
         if len(self.loop) > 0:
-            self.calculate_shortest_path(str(packet.src), str(packet.dst))
+            self.calculate_shortest_path(src, dst)
 
             # we have a loop caution
             if dst_port is None:
@@ -252,26 +678,12 @@ class SimpleController(object):
             else:
                 # Since we know the switch ports for both the source and dest
                 # MACs, we can install rules for both directions.
-                msg = of.ofp_flow_mod()
-                msg.match.dl_dst = packet.src
-                msg.match.dl_src = packet.dst
-                msg.priority = 1
-                msg.hard_timeout = int(self.traffic_pair_counter[packet.dst, packet.src] * 2)
-                msg.idle_timeout = int(self.traffic_pair_counter[packet.dst, packet.src])
-                msg.actions.append(of.ofp_action_output(port=event.port))
-                event.connection.send(msg)
+                self.install_learned_flow(event, dst, src, event.port)
 
                 # This is the packet that just came in -- we want to
                 # install the rule and also resend the packet.
-                msg = of.ofp_flow_mod()
-                msg.data = event.ofp  # Forward the incoming packet
-                msg.match.dl_src = packet.src
-                msg.match.dl_dst = packet.dst
-                msg.priority = 1
-                msg.hard_timeout = int(self.traffic_pair_counter[packet.src, packet.dst] * 2)
-                msg.idle_timeout = int(self.traffic_pair_counter[packet.src, packet.dst])
-                msg.actions.append(of.ofp_action_output(port=dst_port))
-                event.connection.send(msg)
+                self.install_learned_flow(event, src, dst, dst_port,
+                                          data=event.ofp)  # Forward the incoming packet
 
                 # log.info("Installing %s <-> %s" % (packet.src, packet.dst))
         else:
@@ -286,29 +698,46 @@ class SimpleController(object):
             else:
                 # Since we know the switch ports for both the source and dest
                 # MACs, we can install rules for both directions.
-                msg = of.ofp_flow_mod()
-                msg.match.dl_dst = packet.src
-                msg.match.dl_src = packet.dst
-                msg.priority = 1
-                msg.hard_timeout = int(self.traffic_pair_counter[packet.dst, packet.src] * 2)
-                msg.idle_timeout = int(self.traffic_pair_counter[packet.dst, packet.src])
-                msg.actions.append(of.ofp_action_output(port=event.port))
-                event.connection.send(msg)
+                self.install_learned_flow(event, dst, src, event.port)
 
                 # This is the packet that just came in -- we want to
                 # install the rule and also resend the packet.
-                msg = of.ofp_flow_mod()
-                msg.data = event.ofp  # Forward the incoming packet
-                msg.match.dl_src = packet.src
-                msg.match.dl_dst = packet.dst
-                msg.priority = 1
-                msg.hard_timeout = int(self.traffic_pair_counter[packet.src, packet.dst] * 2)
-                msg.idle_timeout = int(self.traffic_pair_counter[packet.src, packet.dst])
-                msg.actions.append(of.ofp_action_output(port=dst_port))
-                event.connection.send(msg)
+                self.install_learned_flow(event, src, dst, dst_port,
+                                          data=event.ofp)  # Forward the incoming packet
 
                 # log.info("Installing %s <-> %s" % (packet.src, packet.dst))
 
+    def install_learned_flow(self, event, src, dst, out_port, data=None):
+        """
+        Install a src -> dst rule on the switch of a PacketIn, with timeouts
+        from the flow lifetime model. If that takes the switch over its rule
+        budget the coldest learned rules are deleted.
+        Args:
+            event: the PacketIn
+            src: source MAC of the rule, as an int
+            dst: destination MAC of the rule, as an int
+            out_port: where to send matching packets
+            data: the packet to send along with the rule, if any
+        """
+        msg = of.ofp_flow_mod()
+        if data is not None:
+            msg.data = data
+        msg.match.dl_src = int_to_mac(src)
+        msg.match.dl_dst = int_to_mac(dst)
+        msg.priority = 1
+        msg.idle_timeout, msg.hard_timeout = self.flow_lifetime.timeouts(src, dst, time.time())
+        msg.flags = of.OFPFF_SEND_FLOW_REM
+        msg.actions.append(of.ofp_action_output(port=out_port))
+        event.connection.send(msg)
+        self.metrics.count("flow_mods", "learned")
+        for old_src, old_dst in self.flow_lifetime.installed(event.dpid, src, dst):
+            msg = of.ofp_flow_mod(command=of.OFPFC_DELETE_STRICT)
+            msg.match.dl_src = int_to_mac(old_src)
+            msg.match.dl_dst = int_to_mac(old_dst)
+            msg.priority = 1
+            event.connection.send(msg)
+            self.metrics.count("flow_mods", "evicted")
+
     def calculate_shortest_path(self, source_mac, dst_mac):
         """
         If we have a source and a target mac address we try to calculate a shortest path
@@ -316,154 +745,264 @@ class SimpleController(object):
         we fire up the shortest_path_flow_modifications where we  analyse the path and
         create and install the flows on the switches
         Args:
-            source_mac: the source of the request
-            dst_mac: the destination of the request
+            source_mac: the source of the request, as an int
+            dst_mac: the destination of the request, as an int
         """
-        if source_mac in self.topology.nodes() and dst_mac in self.topology.nodes():
-            shortest_path = nx.shortest_path(self.topology, source=source_mac, target=dst_mac)
-            print shortest_path
-            print len(shortest_path)
+        source = self.addresses.find_host(source_mac)
+        target = self.addresses.find_host(dst_mac)
+        if source is None or target is None:
+            return
+        with self.metrics.time("calculate_shortest_path"):
+            shortest_path = self.select_path(source, target)
+        if shortest_path is not None:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Path of %i nodes: %s", len(shortest_path),
+                          " ".join(self.addresses.name(node) for node in shortest_path))
             if len(shortest_path)>2:
                 self.shortest_path_flow_modifications(shortest_path)
 
+    def select_path(self, source, target):
+        """
+        The path between two hosts in the routing mode we run
+        Args:
+            source: the source host node
+            target: the destination host node
+        Returns: list of nodes from source to destination, None if there is
+        no path in our topology yet
+        """
+        snapshot = self.topology_store.current
+        topology = snapshot.graph
+        if source not in topology or target not in topology:
+            return None
+        try:
+            if self.congestion is not None:
+                return self.congestion.shortest_path(topology, source, target)
+            if self.ecmp is not None:
+                return self.ecmp.shortest_path(topology, snapshot.version, source, target)
+            return snapshot.shortest_path(source, target)
+        except nx.NetworkXNoPath:
+            return None
+
     def shortest_path_flow_modifications(self, shortest_path):
         """
         Analyze a shortest path to datapaths and apply flow modification
-        rules
+        rules, for both directions of the path
         Args:
             shortest_path: the shortest path calculated in calculate_shortest_path
         """
-        source = shortest_path[0]
-        target = shortest_path[-1]
-        if not self.paths_applied.get((source,target)):
-            sourceip = self.ip_to_mac.get(source)
-            targetip = self.ip_to_mac.get(target)
-            switch_only = shortest_path[1:-1]
-            for con in core.openflow._connections.values():
-
-                if pox.lib.util.dpid_to_str(con.dpid) in switch_only:
-                    switch_index = shortest_path.index(pox.lib.util.dpid_to_str(con.dpid))
-                    ip_port_prev_datapath = shortest_path[switch_index-1]
-                    ip_port_next_datapath = shortest_path[switch_index+1]
-                    if ":" in ip_port_prev_datapath and ":" in ip_port_next_datapath:
-                        in_port = self.mac_to_port.get(ip_port_prev_datapath)
-                        out_port = self.mac_to_port.get(ip_port_next_datapath)
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    if ":" in ip_port_prev_datapath and "-" in ip_port_next_datapath:
-                        print pox.lib.util.dpid_to_str(con.dpid), ip_port_next_datapath
-                        in_port = self.mac_to_port.get(ip_port_prev_datapath)
-                        out_port = self.switch_links_to_port.get((pox.lib.util.dpid_to_str(con.dpid),ip_port_next_datapath))[0]
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    if ":" in ip_port_next_datapath and "-" in ip_port_prev_datapath:
-                        in_port = self.switch_links_to_port.get((pox.lib.util.dpid_to_str(con.dpid),ip_port_prev_datapath))[1]
-                        out_port = self.mac_to_port.get(ip_port_next_datapath)
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    if "-" in ip_port_next_datapath and "-" in ip_port_prev_datapath:
-                        # switch -- switch -- switch
-                        in_port = self.switch_links_to_port.get((ip_port_prev_datapath, pox.lib.util.dpid_to_str(con.dpid)))[1]
-                        out_port = self.switch_links_to_port.get((pox.lib.util.dpid_to_str(con.dpid), ip_port_next_datapath))[0]
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    self.paths_applied[(source,target)] = shortest_path
-        #reversed
-        shortest_path.reverse()
-        source = shortest_path[0]
-        target = shortest_path[-1]
-        if not self.paths_applied.get((source,target)):
-            sourceip = self.ip_to_mac.get(source)
-            targetip = self.ip_to_mac.get(target)
-            switch_only = shortest_path[1:-1]
-            for con in core.openflow._connections.values():
-                if pox.lib.util.dpid_to_str(con.dpid) in switch_only:
-                    switch_index = shortest_path.index(pox.lib.util.dpid_to_str(con.dpid))
-                    ip_port_prev_datapath = shortest_path[switch_index-1]
-                    ip_port_next_datapath = shortest_path[switch_index+1]
-                    if ":" in ip_port_prev_datapath and ":" in ip_port_next_datapath:
-                        in_port = self.mac_to_port.get(ip_port_prev_datapath)
-                        out_port = self.mac_to_port.get(ip_port_next_datapath)
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    if ":" in ip_port_prev_datapath and "-" in ip_port_next_datapath:
-                        print pox.lib.util.dpid_to_str(con.dpid), ip_port_next_datapath
-                        in_port = self.mac_to_port.get(ip_port_prev_datapath)
-                        out_port = self.switch_links_to_port.get((pox.lib.util.dpid_to_str(con.dpid),ip_port_next_datapath))[0]
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    if ":" in ip_port_next_datapath and "-" in ip_port_prev_datapath:
-                        in_port = self.switch_links_to_port.get((pox.lib.util.dpid_to_str(con.dpid),ip_port_prev_datapath))[1]
-                        out_port = self.mac_to_port.get(ip_port_next_datapath)
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    if "-" in ip_port_next_datapath and "-" in ip_port_prev_datapath:
-                        # switch -- switch -- switch
-                        in_port = self.switch_links_to_port.get((ip_port_prev_datapath, pox.lib.util.dpid_to_str(con.dpid)))[1]
-                        out_port = self.switch_links_to_port.get((pox.lib.util.dpid_to_str(con.dpid), ip_port_next_datapath))[0]
-                        msg = of.ofp_flow_mod()
-                        msg.match = of.ofp_match()
-                        msg.match._in_port = in_port
-                        msg.match.dl_src = EthAddr(source)
-                        msg.match.dl_dst = EthAddr(target)
-                        msg.priority = 100
-                        msg.actions.append(of.ofp_action_output(port = out_port))
-                        con.send(msg)
-                    self.paths_applied[(source,target)] = shortest_path
-
-# @poxutil.eval_args
-def launch ():
+        with self.metrics.time("shortest_path_flow_modifications"):
+            version = self.topology_version
+            for path in (shortest_path, shortest_path[::-1]):
+                source = path[0]
+                target = path[-1]
+                if self.paths_applied.fresh((source,target), version) is not None:
+                    self.metrics.count("paths", "already_applied")
+                    continue
+                old_path = self.paths_applied.get((source,target))
+                if old_path == path:
+                    # installed on an older topology but still the path, its rules stay
+                    self.paths_applied.set((source,target), path, version)
+                    self.metrics.count("paths", "kept")
+                    continue
+                if old_path is not None:
+                    # installed on an older topology and routed elsewhere now
+                    self.reroute_path(old_path, path)
+                    self.metrics.count("paths", "rerouted")
+                    continue
+                if self.rule_compiler is not None:
+                    self.send_rules(self.rule_compiler.add(source, target, self.path_hops(path)))
+                else:
+                    self.send_path_flows(source, target, self.path_hops(path))
+                self.paths_applied.set((source,target), path, version)
+                self.backups.track(source, target, path)
+                self.metrics.count("paths", "installed")
+
+    def reroute_path(self, old_path, new_path):
+        """
+        Move an installed path. The new rules go in first and only then the
+        rules of the old path that the new one did not overwrite are removed
+        Args:
+            old_path: the path in paths_applied
+            new_path: the path to use from now on
+        """
+        source = new_path[0]
+        target = new_path[-1]
+        new_hops = self.path_hops(new_path)
+        if self.rule_compiler is not None:
+            left = set(old_path[1:-1]) - set(new_path[1:-1])
+            self.send_rules(self.rule_compiler.add(source, target, new_hops) +
+                            self.rule_compiler.remove(source, target, left))
+        else:
+            kept = set((switch, in_port) for switch, in_port, out_port in new_hops)
+            stale = [hop for hop in self.path_hops(old_path) if hop[:2] not in kept]
+            self.send_path_flows(source, target, new_hops)
+            self.send_path_flows(source, target, stale, command=of.OFPFC_DELETE_STRICT)
+        self.paths_applied.set((source,target), new_path, self.topology_version)
+        self.backups.track(source, target, new_path)
+
+    def forget_path(self, path):
+        """
+        Delete an installed path's rules, its pair is routed again on its
+        next PacketIn
+        Args:
+            path: the path in paths_applied
+        """
+        source = path[0]
+        target = path[-1]
+        if self.rule_compiler is not None:
+            self.send_rules(self.rule_compiler.remove(source, target, path[1:-1]))
+        else:
+            self.send_path_flows(source, target, self.path_hops(path), command=of.OFPFC_DELETE_STRICT)
+        self.paths_applied.pop((source,target), None)
+        self.backups.untrack(source, target)
+
+    def path_hops(self, path):
+        """
+        The switches of a path with the port the flow enters and leaves each
+        Args:
+            path: host, switches..., host as nodes
+        Returns: list of (switch, in_port, out_port)
+        """
+        return [(path[i], self.port_towards(path[i], path[i-1]), self.port_towards(path[i], path[i+1]))
+                for i in range(1, len(path)-1)]
+
+    def port_towards(self, switch, node):
+        """
+        The port of switch that leads to node
+        Args:
+            switch: a switch node
+            node: a neighbouring switch or host node
+        """
+        if self.addresses.is_host(node):
+            return self.mac_to_port.get(node)
+        ports = self.switch_links_to_port.get((switch, node))
+        return ports[0] if ports else None
+
+    def edge_port(self, u, v):
+        """
+        The switch port carrying the traffic of a topology edge
+        Args:
+            u, v: the nodes of the edge, switches or hosts
+        Returns: (dpid, port) or None if we do not know the port yet
+        """
+        if self.addresses.is_host(u):
+            u, v = v, u
+        port = self.port_towards(u, v)
+        if port is None:
+            return None
+        return self.addresses.address(u), port
+
+    def send_path_flows(self, source, target, hops, command=of.OFPFC_ADD):
+        """
+        Send the flow mods of a source -> target path to its switches
+        Args:
+            source: source host node
+            target: destination host node
+            hops: (switch, in_port, out_port) as returned from path_hops
+            command: the flow mod command
+        """
+        dl_src = int_to_mac(self.addresses.address(source))
+        dl_dst = int_to_mac(self.addresses.address(target))
+        for switch, in_port, out_port in hops:
+            con = core.openflow.getConnection(self.addresses.address(switch))
+            if con is None:
+                continue
+            msg = of.ofp_flow_mod(command=command)
+            msg.match = of.ofp_match()
+            msg.match.in_port = in_port
+            msg.match.dl_src = dl_src
+            msg.match.dl_dst = dl_dst
+            msg.priority = 100
+            if command != of.OFPFC_DELETE_STRICT:
+                msg.actions.append(of.ofp_action_output(port = out_port))
+            con.send(msg)
+            self.metrics.count("flow_mods", "path_delete" if command == of.OFPFC_DELETE_STRICT else "path")
+
+    def send_rules(self, rules):
+        """
+        Send the rules the rule compiler came up with
+        Args:
+            rules: list of (switch, source host or None, destination host,
+                out_port, command), a None source is a destination only rule
+        """
+        for switch, source, target, out_port, command in rules:
+            con = core.openflow.getConnection(self.addresses.address(switch))
+            if con is None:
+                continue
+            msg = of.ofp_flow_mod(command=command)
+            msg.match = of.ofp_match()
+            msg.match.dl_dst = int_to_mac(self.addresses.address(target))
+            if source is None:
+                msg.priority = RuleCompiler.DEFAULT_PRIORITY
+            else:
+                msg.match.dl_src = int_to_mac(self.addresses.address(source))
+                msg.priority = RuleCompiler.EXACT_PRIORITY
+            if command != of.OFPFC_DELETE_STRICT:
+                msg.actions.append(of.ofp_action_output(port = out_port))
+            con.send(msg)
+            self.metrics.count("flow_mods", "path_delete" if command == of.OFPFC_DELETE_STRICT else "path")
+
+    def log_flow_table_occupancy(self):
+        """
+        Log how many path rules each switch would hold without the rule
+        compiler and how many it holds with it
+        """
+        for switch, (before, after) in sorted(self.rule_compiler.occupancy().items()):
+            log.info("Flow table of %s: %i path rules, %i after aggregation",
+                     self.addresses.name(switch), before, after)
+
+@poxutil.eval_args
+def launch (stats_budget=100, stats_interval=1.0, routing="hops", link_capacity=1000, ecmp_paths=4,
+            proactive=False, proactive_rate=50, flow_table_size=1000, aggregate_flows=False,
+            arp_proxy=False, arp_max_age=300, metrics_port=0, packet_in_limit=0, packet_in_block=5,
+            checkpoint="", checkpoint_interval=30, top_flows=0, cluster="", cluster_id=0, ipv6=True):
     """
     Launch for the main SDN Controller Application Component
     Launch with sudo python pox.py pythess. On launch we fire up
     discovery to discover openflow enabled switches
     and host_tracker to discover hosts connected on our switches
+    Args:
+        stats_budget: stats requests per second shared by all switches
+        stats_interval: seconds between stats polls of a busy switch
+        routing: "hops" for hop count shortest paths, "bandwidth" for the
+            least congested path by measured link utilization, "ecmp" to
+            spread host pairs over the equal cost shortest paths
+        link_capacity: link capacity in Mbit/s for the utilization
+        ecmp_paths: equal cost paths to spread over in ecmp routing
+        proactive: install the paths to every known host when a host is found
+        proactive_rate: flow mods per second and switch for proactive installs
+        flow_table_size: learned rules a switch holds before the coldest go
+        aggregate_flows: install path rules per destination where the paths
+            agree instead of one per host pair
+        arp_proxy: answer ARP requests and IPv6 neighbor solicitations from
+            the controller's IP to MAC cache
+        arp_max_age: seconds an IP to MAC binding is answered from
+        metrics_port: serve the controller's metrics on
+            http://127.0.0.1:metrics_port/metrics, 0 for off
+        packet_in_limit: PacketIns per second processed from each switch
+            port, 0 for no limit
+        packet_in_block: seconds the table misses of a host port over the
+            limit are dropped by its switch
+        checkpoint: file to save the controller's state to and warm start
+            from, "" for none
+        checkpoint_interval: seconds between two checkpoints
+        top_flows: poll flow stats and keep this many of the busiest flows
+            of every switch, 0 for no flow stats
+        cluster: host:port of the cluster bus of every controller, comma
+            separated and in the same order on all of them, "" to run alone
+        cluster_id: our index in cluster
+        ipv6: forward IPv6 like IPv4, or drop it on the switches if False
     """
     pox.openflow.discovery.launch()
     pox.host_tracker.launch()
-    sdnc = SimpleController()
+    sdnc = SimpleController(stats_budget=stats_budget, stats_interval=stats_interval,
+                            routing=routing, link_capacity=link_capacity, ecmp_paths=ecmp_paths,
+                            proactive=proactive, proactive_rate=proactive_rate,
+                            flow_table_size=flow_table_size, aggregate_flows=aggregate_flows,
+                            arp_proxy=arp_proxy, arp_max_age=arp_max_age, metrics_port=metrics_port,
+                            packet_in_limit=packet_in_limit, packet_in_block=packet_in_block,
+                            checkpoint=checkpoint, checkpoint_interval=checkpoint_interval,
+                            top_flows=top_flows, cluster=cluster, cluster_id=cluster_id, ipv6=ipv6)
     core.register(sdnc)
 
     log.info("PyThess SDN Demo Controller Running.")
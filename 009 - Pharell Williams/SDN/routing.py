@@ -0,0 +1,169 @@
+"""
+Path selection helpers for the PyThess controller.
+"""
+
+import time
+import zlib
+from itertools import islice
+
+import networkx as nx
+from pox.core import core
+from pox.lib.recoco import Timer
+from stats import BandwidthEstimator
+log = core.getLogger()
+
+
+class CongestionAwareRouting(object):
+    """
+    Picks the least congested path using the link utilization measured from
+    port stats. Every edge costs 1 / (1 - utilization), so an idle fabric
+    routes on hop count and a nearly full link looks many hops long. Links
+    are full duplex, so utilization is per direction: the bytes a switch
+    port sent (or, on a host's link, received) against the one-way capacity.
+
+    Installed paths are re-checked periodically. A path is only moved when
+    its busiest link goes over the high threshold and the alternative stays
+    under the low one, and a moved path is left alone for a hold down time,
+    so flows do not flap between two paths with every stats reply.
+    """
+    def __init__(self, controller, capacity=1000, high=0.8, low=0.5, hold_down=10.0,
+                 max_reroutes=10, interval=2.0):
+        """
+        Args:
+            controller: the SimpleController whose topology and stats we use
+            capacity: link capacity in Mbit/s each way, to turn rates into
+                utilization
+            high: utilization above which an installed path gets rerouted
+            low: utilization the new path has to stay under
+            hold_down: seconds a rerouted path is not touched again
+            max_reroutes: paths moved per check at most
+            interval: seconds between checks of the installed paths
+        """
+        self.controller = controller
+        self.capacity = capacity * 1e6
+        self.high = high
+        self.low = low
+        self.hold_down = hold_down
+        self.max_reroutes = max_reroutes
+        self._moved = {}  # (source, target) -> when we last rerouted it
+        self._sent = BandwidthEstimator()  # tx rate of every (dpid, port)
+        self._received = BandwidthEstimator()  # rx rate of every (dpid, port)
+        self._timer = Timer(interval, self.check, recurring=True)
+
+    def port_stats(self, dpid, counters, now):
+        """
+        Fold one port stats reply in
+        Args:
+            dpid: the switch that replied
+            counters: list of (port, rx bytes, tx bytes)
+            now: when the reply arrived
+        """
+        self._received.update(dpid, [(port, rx) for port, rx, tx in counters], now)
+        self._sent.update(dpid, [(port, tx) for port, rx, tx in counters], now)
+
+    def remove_switch(self, dpid):
+        self._sent.remove_switch(dpid)
+        self._received.remove_switch(dpid)
+
+    def utilization(self, u, v):
+        """
+        Fraction of the capacity in use from u towards v
+        """
+        port = self.controller.edge_port(u, v)
+        if port is None:
+            return 0.0
+        # the port is on the switch end of the edge, a host's traffic comes in on it
+        rates = self._received if self.controller.addresses.is_host(u) else self._sent
+        return rates.rate(*port) / self.capacity
+
+    def weight(self, u, v, data):
+        """
+        Edge weight for nx.shortest_path
+        """
+        return 1.0 / max(1.0 - self.utilization(u, v), 0.01)
+
+    def path_utilization(self, path):
+        """
+        Utilization of the busiest edge on a path
+        """
+        return max([self.utilization(u, v) for u, v in zip(path, path[1:])] or [0.0])
+
+    def shortest_path(self, topology, source, target):
+        return nx.shortest_path(topology, source=source, target=target, weight=self.weight)
+
+    def check(self):
+        """
+        Move installed paths off links that crossed the high threshold
+        """
+        now = time.time()
+        moved = 0
+        for (source, target), path in list(self.controller.paths_applied.items()):
+            if moved >= self.max_reroutes:
+                break
+            if now - self._moved.get((source, target), 0) < self.hold_down:
+                continue
+            if self.path_utilization(path) < self.high:
+                continue
+            try:
+                best = self.shortest_path(self.controller.topology, source, target)
+            except (nx.NetworkXException, KeyError):
+                continue
+            if best == path or self.path_utilization(best) >= self.low:
+                continue
+            log.info("Rerouting %s -> %s off a congested path",
+                     self.controller.addresses.name(source), self.controller.addresses.name(target))
+            self.controller.reroute_path(path, best)
+            self._moved[source, target] = now
+            moved += 1
+
+
+class EqualCostMultipath(object):
+    """
+    Spreads host pairs over the equal cost shortest paths between them.
+    The paths of a pair are enumerated once per topology version and the
+    pair is hashed onto one of them, both directions on the same path.
+
+    OpenFlow 1.0 (all POX's of_01 speaks) has no select groups, so the
+    switches cannot hash flows themselves and the spreading is per host pair
+    from the controller.
+    """
+    def __init__(self, k=4):
+        """
+        Args:
+            k: how many equal cost paths to spread over at most
+        """
+        self.k = k
+        self._version = None
+        self._paths = {}  # (node, node) in sorted order -> equal cost paths
+        self.hits = 0  # lookups answered from _paths
+        self.misses = 0  # lookups that had to enumerate the paths
+
+    def paths(self, topology, version, source, target):
+        """
+        Up to k equal cost shortest paths between two nodes, computed once
+        per topology version
+        Args:
+            topology: the networkx topology
+            version: bumped by the controller whenever topology changes
+            source, target: the end nodes, the paths go from the smaller one
+        """
+        if version != self._version:
+            self._paths = {}
+            self._version = version
+        key = (source, target) if source < target else (target, source)
+        paths = self._paths.get(key)
+        if paths is None:
+            self.misses += 1
+            paths = self._paths[key] = list(islice(nx.all_shortest_paths(topology, key[0], key[1]), self.k))
+        else:
+            self.hits += 1
+        return paths
+
+    def shortest_path(self, topology, version, source, target):
+        """
+        The path this host pair hashes to
+        """
+        paths = self.paths(topology, version, source, target)
+        key = (source, target) if source < target else (target, source)
+        path = paths[(zlib.crc32(("%s-%s" % key).encode()) & 0xffffffff) % len(paths)]
+        return list(path) if key[0] == source else path[::-1]
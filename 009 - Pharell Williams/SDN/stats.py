@@ -0,0 +1,386 @@
+"""
+Statistics collection helpers for the PyThess controller.
+"""
+
+import heapq
+import math
+import random
+import time
+
+import numpy as np
+from pox.core import core
+import pox.openflow.libopenflow_01 as of
+from pox.lib.recoco import Timer
+from topology import mac_to_int
+log = core.getLogger()
+
+
+class StatsScheduler(object):
+    """
+    A single scheduler polling stats from every switch. Instead of one timer
+    per switch we keep a queue ordered by when each switch is due next, so
+    the requests are spread over time and capped to a budget per second.
+    The polling interval grows with the number of switches (to stay inside
+    the budget) and backs off for switches whose ports are idle.
+    """
+    def __init__(self, budget=100, min_interval=1.0, max_interval=30.0, tick=0.1):
+        """
+        Args:
+            budget: maximum stats requests sent per second over all switches
+            min_interval: seconds between two polls of a busy switch
+            max_interval: seconds between two polls of an idle switch
+            tick: how often the scheduler wakes up
+        """
+        self.budget = float(budget)
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        # one request body per stats type we poll each round, made by
+        # calling request(dpid), None to skip it this round
+        self.requests = [lambda dpid: of.ofp_port_stats_request(), lambda dpid: of.ofp_queue_stats_request()]
+        self._due = {}  # dpid -> time the switch is polled next
+        self._idle = {}  # dpid -> rounds in a row the switch had no traffic
+        self._queue = []  # heap of (due, dpid), stale entries skipped on pop
+        self._tokens = self.budget
+        self._last_tick = time.time()
+        self._timer = Timer(tick, self._tick, recurring=True)
+
+    def add_switch(self, dpid):
+        """
+        Start polling a switch, at a random point of the current interval so
+        that switches connecting together are not polled together
+        """
+        self._idle[dpid] = 0
+        self._schedule(dpid, time.time() + random.uniform(0, self.interval()))
+
+    def remove_switch(self, dpid):
+        self._due.pop(dpid, None)
+        self._idle.pop(dpid, None)
+
+    def report_activity(self, dpid, active):
+        """
+        Feedback from the stats handlers, idle switches are polled less often
+        Args:
+            dpid: the switch the stats came from
+            active: whether any of its ports moved traffic since the last poll
+        """
+        if dpid in self._idle:
+            self._idle[dpid] = 0 if active else self._idle[dpid] + 1
+
+    def interval(self, dpid=None):
+        """
+        Seconds between two polls of a switch. With many switches the budget
+        rather than min_interval sets the pace.
+        """
+        interval = max(self.min_interval, len(self._due) * len(self.requests) / self.budget)
+        if dpid is not None:
+            interval *= 2 ** min(self._idle.get(dpid, 0), 5)
+        return min(interval, max(self.max_interval, self.min_interval))
+
+    def _schedule(self, dpid, due):
+        self._due[dpid] = due
+        heapq.heappush(self._queue, (due, dpid))
+
+    def _tick(self):
+        now = time.time()
+        cost = len(self.requests)
+        # a budget below the cost of one switch still polls, one switch at a time
+        self._tokens = min(max(self.budget, cost), self._tokens + (now - self._last_tick) * self.budget)
+        self._last_tick = now
+        while self._queue and self._queue[0][0] <= now and self._tokens >= cost:
+            due, dpid = heapq.heappop(self._queue)
+            if self._due.get(dpid) != due:
+                continue
+            connection = core.openflow.getConnection(dpid)
+            if connection is None:
+                self.remove_switch(dpid)
+                continue
+            for request in self.requests:
+                body = request(dpid)
+                if body is not None:
+                    connection.send(of.ofp_stats_request(body=body))
+            self._tokens -= cost
+            self._schedule(dpid, now + self.interval(dpid))
+
+
+class BandwidthEstimator(object):
+    """
+    Bandwidth of every (dpid, port) from the byte counters in port stats
+    replies. Each port gets a row in a few numpy arrays holding the last
+    counter, when we saw it, an EWMA of the rate and a ring of the most
+    recent rate samples, so a whole reply is folded in with array operations.
+    All rates are in bits per second.
+    """
+    def __init__(self, alpha=0.3, history=32, capacity=64):
+        """
+        Args:
+            alpha: weight of the newest sample in the EWMA
+            history: how many recent samples each port keeps
+            capacity: rows allocated up front, doubled when we run out
+        """
+        self.alpha = alpha
+        self.history = history
+        self._rows = {}  # (dpid, port) -> row in the arrays below
+        self._keys = []  # row -> (dpid, port)
+        self._bytes = np.zeros(capacity, dtype=np.int64)  # last rx + tx bytes
+        self._time = np.zeros(capacity)  # when we got the last counter, 0 for never
+        self._ewma = np.zeros(capacity)
+        self._ring = np.zeros((capacity, history))
+        self._pos = np.zeros(capacity, dtype=np.int64)  # next slot to write in the ring
+        self._count = np.zeros(capacity, dtype=np.int64)  # samples seen so far
+
+    def _row(self, key):
+        row = self._rows.get(key)
+        if row is None:
+            row = self._rows[key] = len(self._keys)
+            self._keys.append(key)
+            if row == len(self._ewma):
+                self._grow()
+        return row
+
+    def _grow(self):
+        extra = len(self._ewma)
+        self._bytes = np.concatenate((self._bytes, np.zeros(extra, dtype=np.int64)))
+        self._time = np.concatenate((self._time, np.zeros(extra)))
+        self._ewma = np.concatenate((self._ewma, np.zeros(extra)))
+        self._ring = np.concatenate((self._ring, np.zeros((extra, self.history))))
+        self._pos = np.concatenate((self._pos, np.zeros(extra, dtype=np.int64)))
+        self._count = np.concatenate((self._count, np.zeros(extra, dtype=np.int64)))
+
+    def update(self, dpid, counters, now):
+        """
+        Fold one port stats reply in
+        Args:
+            dpid: the switch that replied
+            counters: list of (port, rx + tx bytes)
+            now: when the reply arrived
+        Returns: numpy array with the rate of each port in counters, 0 for
+        ports seen for the first time or whose counters were reset
+        """
+        if not counters:
+            return np.zeros(0)
+        ports, totals = zip(*counters)
+        rows = np.array([self._row((dpid, port)) for port in ports])
+        totals = np.array(totals, dtype=np.int64)
+        elapsed = now - self._time[rows]
+        delta = totals - self._bytes[rows]
+        valid = (self._time[rows] > 0) & (elapsed > 0) & (delta >= 0)
+        rates = np.zeros(len(rows))
+        rates[valid] = delta[valid] * 8.0 / elapsed[valid]
+
+        sampled = rows[valid]
+        rate = rates[valid]
+        first = self._count[sampled] == 0
+        self._ewma[sampled] = np.where(first, rate, self.alpha * rate + (1 - self.alpha) * self._ewma[sampled])
+        self._ring[sampled, self._pos[sampled]] = rate
+        self._pos[sampled] = (self._pos[sampled] + 1) % self.history
+        self._count[sampled] += 1
+        self._bytes[rows] = totals
+        self._time[rows] = now
+        return rates
+
+    def rate(self, dpid, port):
+        """
+        The smoothed rate of a port, 0 if we know nothing about it
+        """
+        row = self._rows.get((dpid, port))
+        return 0.0 if row is None else float(self._ewma[row])
+
+    def samples(self, dpid, port):
+        """
+        The recent rate samples of a port, oldest first
+        """
+        row = self._rows.get((dpid, port))
+        if row is None:
+            return np.zeros(0)
+        count = min(self._count[row], self.history)
+        return np.roll(self._ring[row], -self._pos[row])[self.history - count:]
+
+    def top(self, k):
+        """
+        The k busiest ports by smoothed rate
+        Returns: list of ((dpid, port), rate), busiest first
+        """
+        used = len(self._keys)
+        k = min(k, used)
+        if k <= 0:
+            return []
+        ewma = self._ewma[:used]
+        rows = np.argpartition(-ewma, k - 1)[:k]
+        rows = rows[np.argsort(-ewma[rows])]
+        return [(self._keys[row], float(ewma[row])) for row in rows]
+
+    def remove_switch(self, dpid):
+        """
+        Forget the rates of a disconnected switch, its rows are kept for
+        when it comes back
+        """
+        for (switch, port), row in self._rows.items():
+            if switch == dpid:
+                self._time[row] = self._ewma[row] = self._count[row] = self._pos[row] = 0
+
+
+class HeavyHitters(object):
+    """
+    Space-saving top-k: at most k flows are counted, a new flow takes over
+    the counter of the smallest one and inherits its count as error, so any
+    flow with more than 1/k of the traffic is sure to be in. Counts decay
+    with a half life, so the index follows recent traffic rather than totals.
+    """
+    def __init__(self, k=32, half_life=30.0):
+        self.k = k
+        self.tau = half_life / math.log(2)
+        self.counts = {}  # flow -> [decayed bytes, error, last byte counter, when we read it]
+        self._decayed = None  # when counts were last decayed
+
+    def decay(self, now):
+        if self._decayed is not None and now > self._decayed:
+            factor = math.exp((self._decayed - now) / self.tau)
+            for entry in self.counts.values():
+                entry[0] *= factor
+                entry[1] *= factor
+        self._decayed = now
+
+    def add(self, flow, amount, counter, now):
+        """
+        Count bytes of a flow
+        Args:
+            flow: the flow key
+            amount: bytes it sent since we last looked
+            counter: its byte counter now, to take exact deltas next time
+            now: when the counter was read
+        """
+        entry = self.counts.get(flow)
+        if entry is not None:
+            entry[0] += amount
+            entry[2] = counter
+            entry[3] = now
+            return
+        if len(self.counts) < self.k:
+            self.counts[flow] = [amount, 0.0, counter, now]
+            return
+        smallest = min(self.counts, key=lambda key: self.counts[key][0])
+        floor = self.counts.pop(smallest)[0]
+        self.counts[flow] = [floor + amount, floor, counter, now]
+
+    def top(self, n):
+        """
+        The n flows with the most recent bytes
+        Returns: list of (flow, decayed bytes, error), largest first
+        """
+        return [(flow, entry[0], entry[1])
+                for flow, entry in heapq.nlargest(n, self.counts.items(), key=lambda item: item[1][0])]
+
+
+class FlowStatsCollector(object):
+    """
+    Finds the elephant flows of every switch from flow stats, in memory
+    bounded by k flows per switch whatever the size of the flow tables.
+
+    Tables are polled incrementally, one output port per poll, so a reply
+    carries a slice of the table and the slices of a switch go round its
+    ports. Replies are read straight from the ofp_flow_stats entries. Bytes
+    are counted per (dl_src, dl_dst) in a HeavyHitters per switch: a flow
+    already counted has the exact delta of its byte counter, a new one the
+    bytes its average rate since install gives for the time since its port
+    was last polled (or over a half life, the first time round).
+    """
+    def __init__(self, k=32, half_life=30.0):
+        """
+        Args:
+            k: flows counted per switch
+            half_life: seconds over which a flow's counted bytes halve
+        """
+        self.k = k
+        self.half_life = half_life
+        self._hitters = {}  # dpid -> HeavyHitters
+        self._next_port = {}  # dpid -> index of the port polled next
+        self._polled = {}  # (dpid, port) -> when a reply last covered its flows
+
+    def request(self, dpid):
+        """
+        The flow stats request of the next table slice of a switch, for
+        StatsScheduler
+        """
+        connection = core.openflow.getConnection(dpid)
+        if connection is None:
+            return None
+        ports = sorted(p for p in connection.ports if p < of.OFPP_MAX)
+        if not ports:
+            return None
+        index = self._next_port.get(dpid, 0) % len(ports)
+        self._next_port[dpid] = index + 1
+        return of.ofp_flow_stats_request(out_port=ports[index])
+
+    def update(self, dpid, entries, now):
+        """
+        Fold a flow stats reply in
+        Args:
+            dpid: the switch that replied
+            entries: the ofp_flow_stats of the reply
+            now: when the reply arrived
+        """
+        hitters = self._hitters.get(dpid)
+        if hitters is None:
+            hitters = self._hitters[dpid] = HeavyHitters(self.k, self.half_life)
+        hitters.decay(now)
+        flows = {}  # (src, dst) -> [bytes, average bytes per second, out port]
+        for entry in entries:
+            match = entry.match
+            if match.dl_dst is None:
+                continue
+            port = None
+            for action in entry.actions:
+                if isinstance(action, of.ofp_action_output):
+                    port = action.port
+                    break
+            if port is None:
+                continue
+            flow = (None if match.dl_src is None else mac_to_int(match.dl_src), mac_to_int(match.dl_dst))
+            duration = entry.duration_sec + entry.duration_nsec / 1e9
+            average = entry.byte_count / duration if duration > 0 else 0.0
+            total = flows.get(flow)
+            if total is None:
+                flows[flow] = [entry.byte_count, average, port]
+            else:
+                total[0] += entry.byte_count
+                total[1] += average
+
+        counts = hitters.counts
+        fresh = []
+        polled = self._polled
+        for flow, (counter, average, port) in flows.items():
+            known = counts.get(flow)
+            if known is not None:
+                delta = counter - known[2]
+                hitters.add(flow, delta if delta >= 0 else counter, counter, now)
+            else:
+                elapsed = now - polled.get((dpid, port), now - self.half_life)
+                fresh.append((min(counter, average * elapsed), flow, counter))
+        # a new flow only stays in if it beats the smallest counted one,
+        # so only the k largest of a reply are worth offering
+        for amount, flow, counter in heapq.nlargest(self.k, fresh):
+            hitters.add(flow, amount, counter, now)
+        for port in set(port for _, _, port in flows.values()):
+            polled[dpid, port] = now
+
+    def top(self, dpid, n=10, now=None):
+        """
+        The n busiest flows of a switch
+        Returns: list of ((src MAC or None, dst MAC) as ints, bits per second),
+        busiest first
+        """
+        hitters = self._hitters.get(dpid)
+        if hitters is None:
+            return []
+        hitters.decay(time.time() if now is None else now)
+        # decayed bytes of a steady flow settle at rate * tau
+        return [(flow, count * 8 / hitters.tau) for flow, count, error in hitters.top(n)]
+
+    def switches(self):
+        return list(self._hitters)
+
+    def remove_switch(self, dpid):
+        self._hitters.pop(dpid, None)
+        self._next_port.pop(dpid, None)
+        for key in [key for key in self._polled if key[0] == dpid]:
+            del self._polled[key]
@@ -0,0 +1,279 @@
+"""
+Topology bookkeeping for the PyThess controller.
+"""
+
+import struct
+import threading
+from collections import OrderedDict
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import networkx as nx
+from pox.core import core
+from pox.lib.addresses import EthAddr
+import pox.lib.util as poxutil
+from compact_graph import CompactGraph
+log = core.getLogger()
+
+HOST = 0
+SWITCH = 1
+_MAC = struct.Struct("!HL")
+
+
+def mac_to_int(addr):
+    """
+    An EthAddr as a 48 bit int
+    """
+    high, low = _MAC.unpack(addr.toRaw())
+    return high << 32 | low
+
+
+def int_to_mac(value):
+    """
+    A 48 bit int as an EthAddr
+    """
+    return EthAddr(_MAC.pack(value >> 32, value & 0xffffffff))
+
+
+class AddressIndex(object):
+    """
+    Numbers the hosts and switches of the topology. A node is a small int
+    with its type (HOST or SWITCH) and address (48 bit MAC or dpid) kept in
+    two lists, so telling a host from a switch is a list lookup and nothing
+    keyed by node hashes strings. Nodes are only added from the POX thread.
+    """
+    def __init__(self):
+        self.kinds = []  # node -> HOST or SWITCH
+        self.addresses = []  # node -> MAC or dpid
+        self._hosts = {}  # MAC -> node
+        self._switches = {}  # dpid -> node
+
+    def host(self, mac):
+        """
+        The node of a host, added if we did not know it
+        """
+        node = self._hosts.get(mac)
+        if node is None:
+            node = self._hosts[mac] = self._add(HOST, mac)
+        return node
+
+    def switch(self, dpid):
+        """
+        The node of a switch, added if we did not know it
+        """
+        node = self._switches.get(dpid)
+        if node is None:
+            node = self._switches[dpid] = self._add(SWITCH, dpid)
+        return node
+
+    def load(self, kinds, addresses):
+        """
+        Take over the numbering of a checkpoint, nodes keep their numbers
+        """
+        self.kinds = list(kinds)
+        self.addresses = list(addresses)
+        self._hosts = dict((address, node) for node, (kind, address) in enumerate(zip(kinds, addresses))
+                           if kind == HOST)
+        self._switches = dict((address, node) for node, (kind, address) in enumerate(zip(kinds, addresses))
+                              if kind == SWITCH)
+
+    def find_host(self, mac):
+        """
+        The node of a host, None if it is not one we know
+        """
+        return self._hosts.get(mac)
+
+    def is_host(self, node):
+        return self.kinds[node] == HOST
+
+    def address(self, node):
+        return self.addresses[node]
+
+    def name(self, node):
+        """
+        How POX would print the node, for logs
+        """
+        if self.kinds[node] == HOST:
+            return str(int_to_mac(self.addresses[node]))
+        return poxutil.dpid_to_str(self.addresses[node])
+
+    def _add(self, kind, address):
+        self.kinds.append(kind)
+        self.addresses.append(address)
+        return len(self.kinds) - 1
+
+
+class TopologySnapshot(object):
+    """
+    One published version of the topology, never modified once published.
+    Hop count paths are read off a shortest path tree per destination,
+    computed the first time a path to that destination is asked for and
+    shared by every source, the most recently used MAX_TREES kept.
+    """
+    __slots__ = ("graph", "version", "_compact", "_trees")
+
+    MAX_TREES = 256
+
+    def __init__(self, graph, version):
+        self.graph = graph
+        self.version = version
+        self._compact = None
+        self._trees = OrderedDict()  # destination -> parent list towards it
+
+    def compact(self):
+        """
+        The graph as a CompactGraph, built the first time it is asked for
+        """
+        if self._compact is None:
+            self._compact = CompactGraph(self.graph)
+        return self._compact
+
+    def shortest_path(self, source, target):
+        """
+        Hop count shortest path from the shortest path tree towards target
+        Returns: the list of nodes from source to target
+        Raises: networkx.NetworkXNoPath if target cannot be reached
+        """
+        compact = self.compact()
+        parent = self._trees.pop(target, None)
+        if parent is None:
+            # the graph is undirected, so the tree grown from target has
+            # every node's next hop towards it
+            parent = compact.bfs_parents(target).tolist()
+            if len(self._trees) >= self.MAX_TREES:
+                self._trees.popitem(last=False)
+        self._trees[target] = parent
+        node = compact.index[source]
+        if parent[node] == -1:
+            raise nx.NetworkXNoPath("No path between %s and %s." % (source, target))
+        path = [compact.nodes[node]]
+        while parent[node] != node:
+            node = parent[node]
+            path.append(compact.nodes[node])
+        return path
+
+
+class PathTable(object):
+    """
+    The installed path of every host pair, with the topology version it was
+    installed on. A path is only fresh on its own version: once the
+    topology changes the pair's next PacketIn routes it again, and sweep()
+    drops the paths the new topology broke.
+    """
+    def __init__(self):
+        self._paths = {}  # (source, target) -> path
+        self._versions = {}  # (source, target) -> version the path was installed on
+
+    def __len__(self):
+        return len(self._paths)
+
+    def get(self, pair, default=None):
+        return self._paths.get(pair, default)
+
+    def fresh(self, pair, version):
+        """
+        The pair's path if it was installed on this topology version, None if
+        it has none or it is stale
+        """
+        if self._versions.get(pair) != version:
+            return None
+        return self._paths.get(pair)
+
+    def set(self, pair, path, version):
+        self._paths[pair] = path
+        self._versions[pair] = version
+
+    def pop(self, pair, default=None):
+        self._versions.pop(pair, None)
+        return self._paths.pop(pair, default)
+
+    def items(self):
+        return list(self._paths.items())
+
+    def values(self):
+        return list(self._paths.values())
+
+    def sweep(self, graph, version):
+        """
+        Find the paths of older versions that the topology no longer has
+        Args:
+            graph: the topology of version
+            version: the current topology version
+        Returns: list of the broken paths, left for the caller to remove
+        """
+        broken = []
+        for pair, path_version in self._versions.items():
+            if path_version == version:
+                continue
+            path = self._paths[pair]
+            if not all(graph.has_edge(u, v) for u, v in zip(path, path[1:])):
+                broken.append(path)
+        return broken
+
+
+class TopologyStore(object):
+    """
+    Copy-on-write topology. Changes are queued to a single writer thread,
+    which applies everything waiting on a copy of the current graph and
+    publishes the result, frozen, as the next version. Readers just take
+    `current` and work on it without any locking, since a published graph
+    never changes under them.
+    """
+    def __init__(self):
+        self.current = TopologySnapshot(nx.freeze(nx.Graph()), 0)
+        self._lock = threading.Lock()  # one publish at a time
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="topology-writer")
+        self._worker.daemon = True
+        self._worker.start()
+
+    @property
+    def graph(self):
+        return self.current.graph
+
+    @property
+    def version(self):
+        return self.current.version
+
+    def submit(self, change, *args):
+        """
+        Queue a change for the writer thread
+        Args:
+            change: called as change(graph, *args) to modify the new version
+        """
+        self._queue.put((change, args))
+
+    def apply(self, changes):
+        """
+        Apply changes to a copy of the current graph and publish it
+        Args:
+            changes: list of (change, args) as given to submit
+        Returns: the published TopologySnapshot, the current one kept if
+        the changes left the graph as it was
+        """
+        with self._lock:
+            draft = nx.Graph(self.current.graph)
+            for change, args in changes:
+                try:
+                    change(draft, *args)
+                except Exception:
+                    log.exception("Topology change %s%s failed", change.__name__, args)
+            graph = self.current.graph
+            if (len(draft) == len(graph) and draft.number_of_edges() == graph.number_of_edges()
+                    and draft.adj == graph.adj):
+                # nothing changed, the paths and trees of this version stay valid
+                return self.current
+            self.current = TopologySnapshot(nx.freeze(draft), self.current.version + 1)
+            return self.current
+
+    def _run(self):
+        while True:
+            changes = [self._queue.get()]
+            while True:
+                try:
+                    changes.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.apply(changes)
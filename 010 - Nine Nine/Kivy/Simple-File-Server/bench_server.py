@@ -0,0 +1,112 @@
+"""
+	Throughput of the file server on a large file, over loopback.
+
+	Downloads the file whole and in parallel Range segments, once with
+	sendfile and once copying through python, and prints MB/s for each:
+
+		python bench_server.py --size 4 --segments 4
+
+	Without --file a file of --size GB is written to the current directory
+	first and removed afterwards.
+"""
+from __future__ import division, print_function
+
+import argparse
+import os
+import socket
+import threading
+import time
+
+from server import FileRequestHandler, PooledHTTPServer
+
+
+def download(port, name, first=None, last=None):
+	"""
+		GET name, or bytes first to last of it, and throw the body away
+		Returns: the number of body bytes received
+	"""
+	request = "GET /%s HTTP/1.0\r\n" % name
+	if first is not None:
+		request += "Range: bytes=%d-%d\r\n" % (first, last)
+	connection = socket.create_connection(("127.0.0.1", port))
+	connection.sendall((request + "\r\n").encode())
+	buffer = bytearray(1024 * 1024)
+	received = 0
+	head = bytearray()
+	while True:
+		n = connection.recv_into(buffer)
+		if not n:
+			break
+		if head is not None:
+			head += buffer[:n]
+			end = head.find(b"\r\n\r\n")
+			if end >= 0:
+				received = len(head) - end - 4
+				head = None
+		else:
+			received += n
+	connection.close()
+	return received
+
+
+def run(port, name, size, segments):
+	"""
+		Fetch the file in segments parallel Range requests
+		Returns: seconds it took
+	"""
+	step = -(-size // segments)
+	results = []
+	threads = []
+	for first in range(0, size, step):
+		last = min(first + step, size) - 1
+		thread = threading.Thread(target=lambda a=first, b=last: results.append(download(port, name, a, b)))
+		threads.append(thread)
+	started = time.time()
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	elapsed = time.time() - started
+	assert sum(results) == size, "got %d of %d bytes" % (sum(results), size)
+	return elapsed
+
+
+def main():
+	parser = argparse.ArgumentParser(description="file server throughput on a large file")
+	parser.add_argument("--file", help="an existing file in the current directory to serve")
+	parser.add_argument("--size", type=float, default=2, help="GB to write when there is no --file")
+	parser.add_argument("--segments", type=int, default=4, help="parallel Range requests")
+	parser.add_argument("--rounds", type=int, default=3)
+	args = parser.parse_args()
+
+	name = args.file
+	if name is None:
+		name = "bench_server.data"
+		block = os.urandom(1024 * 1024)
+		with open(name, "wb") as f:
+			for _ in range(int(args.size * 1024)):
+				f.write(block)
+	size = os.path.getsize(name)
+	FileRequestHandler.log_message = lambda *args: None
+	httpd = PooledHTTPServer(("127.0.0.1", 0), workers=max(args.segments, 1))
+	httpd.serve_in_background()
+	port = httpd.server_address[1]
+	try:
+		run(port, name, size, 1)  # warm the page cache
+		print("%s, %.2f GB\n" % (name, size / 1e9))
+		print("%-10s %12s %12s" % ("", "1 stream", "%d ranges" % args.segments))
+		for use_sendfile in (True, False):
+			FileRequestHandler.use_sendfile = use_sendfile
+			rates = []
+			for segments in (1, args.segments):
+				best = min(run(port, name, size, segments) for _ in range(args.rounds))
+				rates.append(size / best / 1e6)
+			print("%-10s %7.0f MB/s %7.0f MB/s" % ("sendfile" if use_sendfile else "copy", rates[0], rates[1]))
+	finally:
+		httpd.stop()
+		if args.file is None:
+			os.remove(name)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,195 @@
+"""
+	Compressed copies of the served files, negotiated with Accept-Encoding
+	and kept on disk so a file is only compressed once per version
+"""
+import collections
+import gzip
+import hashlib
+import os
+import threading
+try:
+	import brotli
+except ImportError:
+	brotli = None
+
+from index import raw_name
+
+SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# compressed already, another pass only costs time
+COMPRESSED_TYPES = set([
+	"application/gzip", "application/x-gzip", "application/zip", "application/x-bzip2",
+	"application/x-xz", "application/x-7z-compressed", "application/x-rar-compressed",
+	"application/vnd.android.package-archive", "application/java-archive", "application/pdf",
+	"application/ogg", "application/x-compress", "application/x-tar",
+])
+
+
+def compressible(ctype):
+	"""
+		False for the MIME types whose data is compressed already
+	"""
+	ctype = ctype.split(";", 1)[0].strip().lower()
+	if ctype == "image/svg+xml":
+		return True
+	return not ctype.startswith(("image/", "video/", "audio/")) and ctype not in COMPRESSED_TYPES
+
+
+def accepted(header, encodings):
+	"""
+		The one of encodings the Accept-Encoding header gives the highest
+		q-value, the earlier in encodings on a tie, None for the file as it is
+	"""
+	if not header:
+		return None
+	allowed = {}
+	for item in header.split(","):
+		params = item.split(";")
+		quality = 1.0
+		for param in params[1:]:
+			name, _, value = param.partition("=")
+			if name.strip().lower() == "q":
+				try:
+					quality = float(value)
+				except ValueError:
+					pass
+		allowed[params[0].strip().lower()] = quality
+	best = None
+	best_quality = 0
+	for encoding in encodings:
+		quality = allowed.get(encoding, allowed.get("*", 0))
+		if quality > best_quality:
+			best, best_quality = encoding, quality
+	return best
+
+
+class CompressionCache(object):
+	"""
+		gzip and, when the brotli module is installed, brotli copies of the
+		files served, in a directory of their own. A copy is named after the
+		file's path, mtime and size, so a changed file gets a new one and the
+		old ones are never asked for again. The directory is kept under
+		max_bytes by deleting the least recently served copies.
+	"""
+	CHUNK = 256 * 1024
+	# keys of files known not to compress, the least recently asked for go first
+	MAX_USELESS = 4096
+
+	def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_file=None):
+		"""
+			directory: where the copies go, outside the served tree
+			max_bytes: the most the copies may take on disk
+			max_file: files bigger than this are sent as they are, a quarter
+			of max_bytes by default
+		"""
+		self.directory = directory
+		self.max_bytes = max_bytes
+		self.max_file = max_bytes // 4 if max_file is None else max_file
+		self.encodings = ("br", "gzip") if brotli is not None else ("gzip",)
+		self._lock = threading.Lock()
+		self._copies = collections.OrderedDict()  # name -> size, least recently served first
+		self._useless = collections.OrderedDict()  # keys whose copy came out no smaller
+		self._size = 0
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		found = []
+		for name in os.listdir(directory):
+			path = os.path.join(directory, name)
+			if name.endswith(".tmp"):
+				os.remove(path)  # left by a compression cut short
+				continue
+			st = os.stat(path)
+			found.append((st.st_mtime, name, st.st_size))
+		for mtime, name, size in sorted(found):
+			self._copies[name] = size
+			self._size += size
+
+	def __len__(self):
+		return len(self._copies)
+
+	def encoding(self, accept_encoding, ctype, size):
+		"""
+			The encoding to send a file with, None to send it as it is
+		"""
+		if size > self.max_file or size < 256 or not compressible(ctype):
+			return None
+		return accepted(accept_encoding, self.encodings)
+
+	def open(self, path, st, encoding):
+		"""
+			The compressed copy of a file, made now if there is none yet
+			path: the file
+			st: its os.stat
+			encoding: "gzip" or "br"
+			Returns: the copy open for reading, None if it would be no smaller
+		"""
+		version = "\0%r\0%d\0%s" % (st.st_mtime, st.st_size, encoding)
+		key = hashlib.sha1(raw_name(path) + version.encode()).hexdigest()
+		if key in self._useless:
+			self._skipped(key)
+			return None
+		name = key + SUFFIXES[encoding]
+		copy = os.path.join(self.directory, name)
+		try:
+			f = open(copy, "rb")
+		except IOError:
+			size = self._compress(path, copy, encoding)
+			if size >= st.st_size:
+				try:
+					os.remove(copy)
+				except OSError:
+					pass  # another worker got there first
+				self._skipped(key)
+				return None
+			f = open(copy, "rb")
+		else:
+			size = os.fstat(f.fileno()).st_size
+		self._served(name, size)
+		return f
+
+	def _compress(self, path, copy, encoding):
+		"""
+			Write the compressed copy through a temporary file, so no other
+			worker sees it half written
+			Returns: its size
+		"""
+		temporary = "%s.%d.tmp" % (copy, threading.current_thread().ident)
+		try:
+			with open(path, "rb") as source:
+				with open(temporary, "wb") as out:
+					if encoding == "br":
+						compressor = brotli.Compressor(quality=5)
+						for chunk in iter(lambda: source.read(self.CHUNK), b""):
+							out.write(compressor.process(chunk))
+						out.write(compressor.finish())
+					else:
+						with gzip.GzipFile(filename="", mode="wb", compresslevel=6, fileobj=out, mtime=0) as z:
+							for chunk in iter(lambda: source.read(self.CHUNK), b""):
+								z.write(chunk)
+			os.rename(temporary, copy)
+		except:
+			if os.path.exists(temporary):
+				os.remove(temporary)
+			raise
+		return os.path.getsize(copy)
+
+	def _served(self, name, size):
+		with self._lock:
+			if name in self._copies:
+				self._size -= self._copies.pop(name)
+			self._copies[name] = size
+			self._size += size
+			while self._size > self.max_bytes and len(self._copies) > 1:
+				oldest, oldest_size = self._copies.popitem(last=False)
+				self._size -= oldest_size
+				try:
+					os.remove(os.path.join(self.directory, oldest))
+				except OSError:
+					pass
+
+	def _skipped(self, key):
+		with self._lock:
+			self._useless.pop(key, None)
+			self._useless[key] = True
+			while len(self._useless) > self.MAX_USELESS:
+				self._useless.popitem(last=False)
@@ -0,0 +1,296 @@
+"""
+	An in-memory index of the served directories with their listing pages
+	rendered in advance, kept fresh with inotify or by polling
+"""
+import collections
+import ctypes
+import errno
+import logging
+import os
+import stat
+import struct
+import sys
+import threading
+import time
+import zlib
+try:
+	from urllib import quote
+	from cgi import escape
+except ImportError:  # python 3
+	from urllib.parse import quote
+	from html import escape
+log = logging.getLogger(__name__)
+
+# a directory's page, mtime is the directory's, built when we listed it
+Listing = collections.namedtuple("Listing", "body etag mtime built")
+
+# inotify(7)
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_ONLYDIR = 0x1000000
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, length of the name
+
+
+def raw_name(name):
+	"""
+		A file name as the bytes it has on disk
+	"""
+	if isinstance(name, bytes):
+		return name
+	return name.encode(sys.getfilesystemencoding(), "surrogateescape")
+
+
+def render(path, display):
+	"""
+		The listing page of a directory
+		path: the directory
+		display: its path in the URL, ending with a slash
+		Returns: a Listing
+		Raises: OSError if the directory cannot be listed
+	"""
+	mtime = os.stat(path).st_mtime
+	built = time.time()
+	names = os.listdir(path)
+	names.sort(key=lambda name: name.lower())
+	title = escape(display, True)
+	lines = ['<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">',
+		'<html>\n<head>',
+		'<meta http-equiv="Content-Type" content="text/html; charset=utf-8">',
+		'<title>Directory listing for %s</title>\n</head>' % title,
+		'<body>\n<h1>Directory listing for %s</h1>' % title,
+		'<p><a href="?zip">Download this folder as a ZIP</a></p>',
+		'<hr>\n<ul>']
+	for name in names:
+		fullname = os.path.join(path, name)
+		display_name = link = name
+		try:
+			mode = os.lstat(fullname).st_mode
+		except OSError:
+			continue  # gone since listdir
+		if stat.S_ISLNK(mode):
+			display_name = name + "@"
+			if os.path.isdir(fullname):
+				link = name + "/"
+		elif stat.S_ISDIR(mode):
+			display_name = link = name + "/"
+		href = quote(raw_name(link))
+		lines.append('<li><a href="%s">%s</a></li>' % (href, escape(display_name, True)))
+	lines.append('</ul>\n<hr>\n</body>\n</html>\n')
+	body = "\n".join(lines)
+	if not isinstance(body, bytes):
+		body = body.encode("utf-8", "surrogateescape")
+	return Listing(body, '"%08x"' % (zlib.crc32(body) & 0xffffffff), mtime, built)
+
+
+class _Inotify(object):
+	"""
+		Directory watches through inotify(7), with ctypes as python has no binding
+	"""
+	MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ONLYDIR
+
+	def __init__(self):
+		libc = ctypes.CDLL(None, use_errno=True)
+		self._add = libc.inotify_add_watch
+		self._remove = libc.inotify_rm_watch
+		self.fd = libc.inotify_init()
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_init")
+
+	def add(self, path):
+		"""
+			Returns: the watch descriptor
+			Raises: OSError if the directory cannot be watched, ENOSPC when
+			we are at fs.inotify.max_user_watches
+		"""
+		wd = self._add(self.fd, raw_name(path), self.MASK)
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), "inotify_add_watch", path)
+		return wd
+
+	def remove(self, wd):
+		self._remove(self.fd, wd)
+
+	def read(self):
+		"""
+			Block for the next events
+			Returns: list of (wd, mask, name)
+		"""
+		data = os.read(self.fd, 64 * 1024)
+		events = []
+		offset = 0
+		while offset < len(data):
+			wd, mask, cookie, length = _EVENT.unpack_from(data, offset)
+			offset += _EVENT.size
+			name = data[offset:offset + length].rstrip(b"\0")
+			offset += length
+			if not isinstance(name, str):
+				name = name.decode(sys.getfilesystemencoding(), "surrogateescape")
+			events.append((wd, mask, name))
+		return events
+
+
+class DirectoryIndex(object):
+	"""
+		The listing page of every directory under root. A background thread
+		renders them all at start and then keeps them fresh: with inotify it
+		renders again the directories whose entries changed as soon as they
+		do, where there is no inotify it checks every directory's mtime
+		every poll_interval seconds. Directories not indexed yet are
+		rendered on their first request, the ones past the inotify watch
+		limit on every request.
+	"""
+	def __init__(self, root, poll_interval=5.0):
+		"""
+			root: the served directory
+			poll_interval: seconds between two polls, without inotify
+		"""
+		self.root = os.path.normpath(os.path.abspath(root))
+		self.poll_interval = poll_interval
+		self._listings = {}  # directory -> Listing
+		self._inotify = None
+		try:
+			self._inotify = _Inotify()
+		except (OSError, AttributeError) as e:
+			log.info("No inotify (%s), polling directories every %s seconds", e, poll_interval)
+		self._watches = {}  # wd -> directory
+		self._lock = threading.Lock()  # held around watch changes
+		self._warned = False
+
+	def start(self):
+		thread = threading.Thread(target=self._run, name="directory-index")
+		thread.daemon = True
+		thread.start()
+		return thread
+
+	def listing(self, path):
+		"""
+			The Listing of a directory, rendered now if it is not indexed
+			Raises: OSError if it cannot be listed
+		"""
+		path = os.path.normpath(path)
+		listing = self._listings.get(path)
+		if listing is None and self._watch(path):
+			listing = render(path, self._display(path))
+			# a newer page from the index thread wins over ours
+			listing = self._listings.setdefault(path, listing)
+		elif listing is None:
+			listing = render(path, self._display(path))
+		return listing
+
+	def __len__(self):
+		return len(self._listings)
+
+	def _display(self, path):
+		relative = os.path.relpath(path, self.root)
+		if relative == os.curdir:
+			return "/"
+		return "/" + relative.replace(os.sep, "/") + "/"
+
+	def _render(self, path):
+		try:
+			self._listings[path] = render(path, self._display(path))
+		except OSError:
+			self._forget(path)
+
+	def _run(self):
+		started = time.time()
+		self._index(self.root)
+		log.info("Indexed %d directories in %.1f s", len(self._listings), time.time() - started)
+		if self._inotify is not None:
+			while True:
+				self._watch_events()
+		while True:
+			time.sleep(self.poll_interval)
+			self._poll()
+
+	def _index(self, top):
+		"""
+			Render every directory under top, watching it first so no change
+			slips in between
+		"""
+		for path, dirs, files in os.walk(top):
+			path = os.path.normpath(path)
+			if self._watch(path):
+				self._render(path)
+			else:
+				self._listings.pop(path, None)
+
+	def _watch(self, path):
+		"""
+			Make sure inotify watches a directory
+			Returns: True if its listing may be cached, False if it has to be
+			rendered on every request
+		"""
+		inotify = self._inotify
+		if inotify is None:
+			return True
+		with self._lock:
+			try:
+				self._watches[inotify.add(path)] = path
+				return True
+			except OSError as e:
+				if e.errno == errno.ENOSPC and not self._warned:
+					self._warned = True
+					log.warning("Out of inotify watches, raise fs.inotify.max_user_watches, "
+						"directories past it are listed on every request")
+				return False
+
+	def _watch_events(self):
+		dirty = set()
+		indexed = []
+		for wd, mask, name in self._inotify.read():
+			if mask & IN_Q_OVERFLOW:
+				# events were lost, render everything again
+				dirty.update(self._listings)
+				continue
+			if mask & IN_IGNORED:  # the directory went away
+				with self._lock:
+					self._watches.pop(wd, None)
+				continue
+			path = self._watches.get(wd)
+			if path is None:
+				continue
+			dirty.add(path)
+			if mask & IN_ISDIR and mask & (IN_DELETE | IN_MOVED_FROM):
+				self._forget(os.path.join(path, name))
+			elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+				indexed.append(os.path.join(path, name))
+		for path in indexed:
+			self._index(path)
+		for path in dirty:
+			if path in self._listings:
+				self._render(path)
+
+	def _forget(self, top):
+		"""
+			Drop a directory that went away and everything indexed below it
+		"""
+		below = top + os.sep
+		for path in list(self._listings):
+			if path == top or path.startswith(below):
+				self._listings.pop(path, None)
+		inotify = self._inotify
+		if inotify is None:
+			return
+		with self._lock:
+			for wd, path in list(self._watches.items()):
+				if path == top or path.startswith(below):
+					del self._watches[wd]
+					inotify.remove(wd)
+
+	def _poll(self):
+		for path, listing in list(self._listings.items()):
+			try:
+				mtime = os.stat(path).st_mtime
+			except OSError:
+				self._listings.pop(path, None)
+				continue
+			# on storage with one second mtimes a change in the second we
+			# listed the directory leaves its mtime as it was
+			if mtime != listing.mtime or listing.built - listing.mtime < 2:
+				self._render(path)
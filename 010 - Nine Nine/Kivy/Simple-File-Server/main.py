@@ -1,29 +1,21 @@
-import SimpleHTTPServer
-import SocketServer
 import kivy
 kivy.require('1.9.1') # replace with your current kivy version !
-from kivy.clock import Clock
 from kivy.app import App
 from kivy.uix.label import Label
+import os
 import socket
+from compression import CompressionCache
+from index import DirectoryIndex
+from server import PooledHTTPServer
 
 # first find out the IP your phone has
 ip = ([(s.connect(('8.8.8.8', 80)), s.getsockname()[0], s.close()) for s in [socket.socket(socket.AF_INET, socket.SOCK_DGRAM)]][0][1])
 PORT = 8008 # the port to serve
+WORKERS = 8 # downloads served at once, the next ones wait for a free worker
+COMPRESSED_CACHE = 64 * 1024 * 1024 # bytes of compressed copies of text files kept on disk
 msg = "serving at port" + str(ip)+':'+ str(PORT) # the msg to display
 #somehing like "serving at port 192.168.1.1:8008" so we know the address to put in our browser
 
-def my_callback(instance):
-	"""
-		This is the lighter version of a simple Python http server
-	"""
-	Handler = SimpleHTTPServer.SimpleHTTPRequestHandler
-	httpd = SocketServer.TCPServer(("", PORT), Handler)
-	httpd.serve_forever() # this blocks our main thread to avoid we use Clock 'see below'
-
-# to avoid blocking the main thread schedule to run the server 5 seconds after the app starts
-Clock.schedule_once(my_callback, 5)
-
 class MyApp(App):
 	"""
 		The main app, just return a label with our msg ex. "serving at port 192.168.1.1:8008"
@@ -31,6 +23,19 @@ class MyApp(App):
 	def build(self):
 		return Label(text=msg)
 
+	def on_start(self):
+		"""
+			Start the file server on its own threads, the UI thread only draws
+		"""
+		index = DirectoryIndex(os.getcwd())
+		index.start() # lists every directory in the background, then keeps the pages fresh
+		compression = CompressionCache(os.path.join(self.user_data_dir, "compressed"), max_bytes=COMPRESSED_CACHE)
+		self.httpd = PooledHTTPServer(("", PORT), workers=WORKERS, index=index, compression=compression)
+		self.httpd.serve_in_background()
+
+	def on_stop(self):
+		self.httpd.stop()
+
 
 if __name__ == '__main__':
     MyApp().run()
@@ -0,0 +1,338 @@
+"""
+	The HTTP file server behind the app, kept apart from the Kivy UI so it
+	runs on its own threads and never blocks the main one
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from email.utils import mktime_tz, parsedate_tz
+from io import BytesIO
+try:
+	import Queue as queue
+	from BaseHTTPServer import HTTPServer
+	from SimpleHTTPServer import SimpleHTTPRequestHandler
+except ImportError:  # python 3
+	import queue
+	from http.server import HTTPServer, SimpleHTTPRequestHandler
+try:
+	from urllib import quote
+except ImportError:  # python 3
+	from urllib.parse import quote
+
+from compression import compressible
+from index import raw_name
+from zipstream import zip_directory
+log = logging.getLogger(__name__)
+
+
+class _Unsatisfiable(Exception):
+	pass
+
+
+class FileRequestHandler(SimpleHTTPRequestHandler):
+	"""
+		Serves the files of the current directory, one request per connection.
+		Files go out with sendfile, the kernel copying from the page cache to
+		the socket, and a single byte Range is honoured so interrupted
+		downloads resume and download managers can fetch segments in parallel.
+		Directory listings come pre-rendered from the server's index and are
+		validated with ETag and Last-Modified. Text is sent compressed to the
+		clients that accept it, from the server's compression cache. A
+		directory URL with ?zip downloads the whole directory as a ZIP.
+	"""
+	# a client that stops reading or sending for this long gives its worker back
+	timeout = 60
+	# socket.sendfile (os.sendfile underneath) where python has it, python 2
+	# copies through CHUNK sized reads
+	use_sendfile = True
+	CHUNK = 256 * 1024
+	# logs and data files as text, so they get compressed
+	extensions_map = dict(SimpleHTTPRequestHandler.extensions_map, **{
+		".log": "text/plain", ".csv": "text/csv", ".json": "application/json", ".md": "text/plain"})
+
+	def send_head(self):
+		"""
+			Send the headers of a GET or HEAD
+			Returns: the file to send the body from, None if there is no body
+		"""
+		self.body_range = None  # (offset, count) of the file to send
+		path = self.translate_path(self.path)
+		if os.path.isdir(path):
+			if "zip" in self.path.partition("?")[2].split("&"):
+				return self.send_zip(path)
+			if not self.path.split("?", 1)[0].endswith("/"):
+				return SimpleHTTPRequestHandler.send_head(self)  # redirects to the slash
+			for index in ("index.html", "index.htm"):
+				if os.path.isfile(os.path.join(path, index)):
+					path = os.path.join(path, index)
+					break
+			else:
+				return self.send_listing(path)
+		try:
+			f = open(path, "rb")
+		except IOError:
+			self.send_error(404, "File not found")
+			return None
+		try:
+			st = os.fstat(f.fileno())
+			size = st.st_size
+			ctype = self.guess_type(path)
+			last_modified = self.date_time_string(st.st_mtime)
+			etag = '"%x-%x"' % (int(st.st_mtime), size)
+			cache = self.server.compression
+			encoding = None
+			if cache is not None:
+				encoding = cache.encoding(self.headers.get("Accept-Encoding"), ctype, size)
+				copy = None
+				if encoding is not None:
+					try:
+						copy = cache.open(path, st, encoding)
+					except (IOError, OSError) as e:
+						# a full disk or no cache directory, the file still goes out
+						log.warning("Cannot compress %s: %s", path, e)
+				if copy is None:
+					encoding = None
+				else:
+					# from here on we serve the copy, ranges are of its bytes
+					f.close()
+					f = copy
+					size = os.fstat(f.fileno()).st_size
+					etag = '"%x-%x-%s"' % (int(st.st_mtime), st.st_size, encoding)
+			try:
+				byte_range = self.requested_range(size, etag, last_modified)
+			except _Unsatisfiable:
+				f.close()
+				self.send_response(416)
+				self.send_header("Content-Range", "bytes */%d" % size)
+				self.send_header("Content-Length", "0")
+				self.end_headers()
+				return None
+			if byte_range is None:
+				first, last = 0, size - 1
+				self.send_response(200)
+			else:
+				first, last = byte_range
+				self.send_response(206)
+				self.send_header("Content-Range", "bytes %d-%d/%d" % (first, last, size))
+			self.send_header("Content-type", ctype)
+			self.send_header("Content-Length", str(last - first + 1))
+			if encoding is not None:
+				self.send_header("Content-Encoding", encoding)
+			if cache is not None and compressible(ctype):
+				self.send_header("Vary", "Accept-Encoding")
+			self.send_header("Last-Modified", last_modified)
+			self.send_header("ETag", etag)
+			self.send_header("Accept-Ranges", "bytes")
+			self.end_headers()
+		except:
+			f.close()
+			raise
+		self.body_range = (first, last - first + 1)
+		return f
+
+	def send_listing(self, path):
+		"""
+			Send the headers of a directory listing, or a 304 if the client's
+			copy is current
+			Returns: the page to send, None if there is no body
+		"""
+		if self.server.index is None:
+			return SimpleHTTPRequestHandler.send_head(self)
+		try:
+			listing = self.server.index.listing(path)
+		except OSError:
+			self.send_error(404, "No permission to list directory")
+			return None
+		if self.not_modified(listing.etag, listing.mtime):
+			self.send_response(304)
+			body = None
+		else:
+			self.send_response(200)
+			self.send_header("Content-type", "text/html; charset=utf-8")
+			self.send_header("Content-Length", str(len(listing.body)))
+			body = BytesIO(listing.body)
+		self.send_header("Last-Modified", self.date_time_string(listing.mtime))
+		self.send_header("ETag", listing.etag)
+		self.end_headers()
+		return body
+
+	def send_zip(self, path):
+		"""
+			Send the headers of a ZIP of a directory, which is then generated as
+			it is sent, without a Content-Length as its size is not known yet
+			Returns: the generator of the archive's bytes
+		"""
+		name = os.path.basename(os.path.normpath(path)) or "files"
+		self.send_response(200)
+		self.send_header("Content-type", "application/zip")
+		self.send_header("Content-Disposition", "attachment; filename=\"%s.zip\"; filename*=UTF-8''%s.zip"
+			% (name.replace('"', "_"), quote(raw_name(name))))
+		self.end_headers()
+		# deflate what compresses, store media and archives as they are
+		return zip_directory(path, name, lambda fullname: compressible(self.guess_type(fullname)))
+
+	def not_modified(self, etag, mtime):
+		"""
+			True if the client's cached copy, by If-None-Match or else
+			If-Modified-Since, is the one we have
+		"""
+		match = self.headers.get("If-None-Match")
+		if match is not None:
+			return match.strip() == "*" or etag in [tag.strip() for tag in match.split(",")]
+		since = self.headers.get("If-Modified-Since")
+		if since is None:
+			return False
+		since = parsedate_tz(since)
+		return since is not None and mktime_tz(since) >= int(mtime)
+
+	def requested_range(self, size, etag, last_modified):
+		"""
+			The byte range the Range header asks for
+			Returns: (first, last) byte, inclusive, or None to send the whole
+			file: there is no Range, it is malformed, asks for several ranges
+			or its If-Range validator is not the file's current one
+			Raises: _Unsatisfiable if the range lies past the end of the file
+		"""
+		header = self.headers.get("Range")
+		if not header or not header.startswith("bytes=") or "," in header:
+			return None
+		validator = self.headers.get("If-Range")
+		if validator and validator.strip() not in (etag, last_modified):
+			return None  # the file changed since the client got its first part
+		first, dash, last = header[6:].strip().partition("-")
+		try:
+			if not first:  # "-n", the last n bytes
+				suffix = int(last)
+				if suffix <= 0 or size == 0:
+					raise _Unsatisfiable()
+				return max(size - suffix, 0), size - 1
+			first = int(first)
+			last = int(last) if last else None  # "n-", to the end
+		except ValueError:
+			return None
+		if not dash or last is not None and first > last:
+			return None
+		if first >= size:
+			raise _Unsatisfiable()
+		return first, size - 1 if last is None else min(last, size - 1)
+
+	def copyfile(self, source, outputfile):
+		if not hasattr(source, "read"):  # a ZIP being generated
+			for chunk in source:
+				outputfile.write(chunk)
+			return
+		if self.body_range is None:  # a directory listing
+			return SimpleHTTPRequestHandler.copyfile(self, source, outputfile)
+		offset, count = self.body_range
+		if count <= 0:
+			return
+		if self.use_sendfile and hasattr(self.connection, "sendfile"):
+			outputfile.flush()
+			self.connection.sendfile(source, offset, count)
+			return
+		source.seek(offset)
+		while count > 0:
+			chunk = source.read(min(count, self.CHUNK))
+			if not chunk:
+				break
+			outputfile.write(chunk)
+			count -= len(chunk)
+
+
+class PooledHTTPServer(HTTPServer):
+	"""
+		An HTTP server handing its connections to a fixed pool of worker
+		threads, so one slow download does not hold up the others and a crowd
+		of clients cannot start an unbounded number of threads on the phone.
+		Connections wait in a bounded queue while every worker is busy and
+		are turned away with a 503 once it is full.
+	"""
+	allow_reuse_address = True
+	request_queue_size = 64  # listen backlog
+
+	def __init__(self, address, handler=FileRequestHandler, workers=8, waiting=32, index=None,
+			compression=None):
+		"""
+			address: (host, port) to listen on
+			handler: the request handler class
+			workers: connections served at once
+			waiting: connections that may wait for a worker
+			index: the DirectoryIndex to take listings from, None to have
+			SimpleHTTPRequestHandler list directories on every request
+			compression: the CompressionCache to send text from, None to
+			send every file as it is
+		"""
+		HTTPServer.__init__(self, address, handler)
+		self.index = index
+		self.compression = compression
+		self.waiting = queue.Queue(waiting)
+		self.workers = []
+		for i in range(workers):
+			worker = threading.Thread(target=self._work, name="file-server-%d" % i)
+			worker.daemon = True
+			worker.start()
+			self.workers.append(worker)
+
+	def process_request(self, request, client_address):
+		# called on the serve_forever thread, which only accepts
+		try:
+			self.waiting.put_nowait((request, client_address))
+		except queue.Full:
+			self._refuse(request)
+
+	def _work(self):
+		while True:
+			request, client_address = self.waiting.get()
+			if request is None:
+				return
+			try:
+				self.finish_request(request, client_address)
+			except Exception:
+				self.handle_error(request, client_address)
+			finally:
+				self.shutdown_request(request)
+
+	def _refuse(self, request):
+		try:
+			request.settimeout(1)
+			request.sendall(b"HTTP/1.0 503 Service Unavailable\r\nRetry-After: 5\r\n"
+				b"Content-Length: 0\r\nConnection: close\r\n\r\n")
+		except socket.error:
+			pass
+		self.shutdown_request(request)
+
+	def serve_in_background(self):
+		"""
+			Run serve_forever on a daemon thread, stop it with stop()
+		"""
+		thread = threading.Thread(target=self.serve_forever, name="file-server")
+		thread.daemon = True
+		thread.start()
+		return thread
+
+	def stop(self, wait=2.0):
+		"""
+			Stop accepting, let the workers finish what they are serving and exit
+			wait: seconds to wait for them, the ones still sending after that
+			are daemons and go down with the app
+		"""
+		deadline = time.time() + wait
+		self.shutdown()
+		self.server_close()
+		# connections still waiting for a worker are closed unserved
+		while True:
+			try:
+				request, client_address = self.waiting.get_nowait()
+			except queue.Empty:
+				break
+			if request is not None:
+				self.shutdown_request(request)
+		for worker in self.workers:
+			try:
+				self.waiting.put((None, None), timeout=max(deadline - time.time(), 0.01))
+			except queue.Full:
+				break  # the workers left are stuck sending, they go down as daemons
+		for worker in self.workers:
+			worker.join(max(deadline - time.time(), 0))
@@ -0,0 +1,30 @@
+"""
+	Accept-Encoding negotiation, run with python -m unittest test_compression
+"""
+import unittest
+
+from compression import accepted
+
+
+class AcceptedTest(unittest.TestCase):
+	def test_highest_quality_wins(self):
+		self.assertEqual(accepted("br;q=0.5, gzip;q=1.0", ("br", "gzip")), "gzip")
+		self.assertEqual(accepted("gzip;q=0.2, *;q=0.8", ("br", "gzip")), "br")
+
+	def test_server_order_breaks_ties(self):
+		self.assertEqual(accepted("gzip, br", ("br", "gzip")), "br")
+		self.assertEqual(accepted("*", ("br", "gzip")), "br")
+
+	def test_every_parameter_is_read(self):
+		self.assertEqual(accepted("gzip;foo=1;q=0", ("gzip",)), None)
+		self.assertEqual(accepted("gzip; level=1 ; Q=0.5, br;q=0.4", ("br", "gzip")), "gzip")
+
+	def test_refused(self):
+		self.assertEqual(accepted("", ("gzip",)), None)
+		self.assertEqual(accepted("identity", ("gzip",)), None)
+		self.assertEqual(accepted("*;q=0", ("gzip",)), None)
+		self.assertEqual(accepted("gzip;q=0, *", ("br", "gzip")), "br")
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,245 @@
+"""
+	ZIP archives of whole directories, generated while they are sent
+"""
+import os
+import struct
+import time
+import zlib
+
+from index import raw_name
+
+STORED = 0
+DEFLATED = 8
+
+_LOCAL = struct.Struct("<IHHHHHIIIHH")
+_CENTRAL = struct.Struct("<IHHHHHHIIIHHHHHII")
+_DESCRIPTOR = struct.Struct("<IIII")
+_DESCRIPTOR64 = struct.Struct("<IIQQ")
+_END = struct.Struct("<IHHHHIIH")
+_END64 = struct.Struct("<IQHHIIQQQQ")
+_LOCATOR64 = struct.Struct("<IIQI")
+
+_FLAG_DESCRIPTOR = 0x08  # crc and sizes follow the data
+_FLAG_UTF8 = 0x800
+_ZIP64_LIMIT = 0xffffffff
+# a file this big may not fit 32 bit sizes once deflated, it gets zip64 sizes
+_ZIP64_FILE = 0x7fffffff
+
+
+def _dos_time(mtime):
+	t = time.localtime(mtime)
+	if t.tm_year < 1980:
+		return 0, (1 << 5) | 1  # 1980-01-01, the first date zip has
+	return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), \
+		((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+class ZipStream(object):
+	"""
+		Writes a ZIP archive front to back without seeking, so it can go
+		straight out on a socket. A deflated entry has its crc and sizes in a
+		data descriptor after its data, computed while the data is read in
+		CHUNK sized pieces; a stored one has them in its header, from a first
+		pass over the file. Memory stays at one chunk plus a central
+		directory record per entry. Entries and offsets past 4 GB use zip64.
+	"""
+	CHUNK = 256 * 1024
+
+	def __init__(self):
+		self.offset = 0
+		self._central = []  # central directory records, written at the end
+
+	def _out(self, data):
+		self.offset += len(data)
+		return data
+
+	def directory(self, name, mtime):
+		"""
+			An entry for a directory, name ending with a slash
+			Yields: the bytes of the entry
+		"""
+		name, flags = self._name(name)
+		dos_time, dos_date = _dos_time(mtime)
+		offset = self.offset
+		yield self._out(_LOCAL.pack(0x04034b50, 20, flags, STORED, dos_time, dos_date, 0, 0, 0,
+			len(name), 0) + name)
+		self._record(20, flags, STORED, dos_time, dos_date, 0, 0, 0, name, 0o40755 << 16 | 0x10, offset, False)
+
+	def file(self, name, f, size, mtime, mode, method=DEFLATED):
+		"""
+			An entry for a file
+			name: its path in the archive
+			f: the file, open for reading, of which size bytes are archived
+			mode: its st_mode
+			method: DEFLATED, or STORED for data that does not compress
+			Yields: the bytes of the entry
+		"""
+		if method == STORED:
+			return self._stored(name, f, size, mtime, mode)
+		return self._deflated(name, f, size, mtime, mode)
+
+	def _deflated(self, name, f, size, mtime, mode):
+		name, flags = self._name(name)
+		flags |= _FLAG_DESCRIPTOR
+		dos_time, dos_date = _dos_time(mtime)
+		zip64 = size > _ZIP64_FILE
+		version = 45 if zip64 else 20
+		offset = self.offset
+		if zip64:
+			extra = struct.pack("<HHQQ", 1, 16, 0, 0)
+			header = _LOCAL.pack(0x04034b50, version, flags, DEFLATED, dos_time, dos_date, 0, _ZIP64_LIMIT,
+				_ZIP64_LIMIT, len(name), len(extra)) + name + extra
+		else:
+			header = _LOCAL.pack(0x04034b50, version, flags, DEFLATED, dos_time, dos_date, 0, 0, 0,
+				len(name), 0) + name
+		yield self._out(header)
+
+		crc = 0
+		read = 0
+		written = 0
+		deflate = zlib.compressobj(6, zlib.DEFLATED, -15)
+		while read < size:
+			chunk = f.read(min(self.CHUNK, size - read))
+			if not chunk:
+				break  # the file shrank, archive what there is
+			read += len(chunk)
+			crc = zlib.crc32(chunk, crc)
+			chunk = deflate.compress(chunk)
+			if chunk:
+				written += len(chunk)
+				yield self._out(chunk)
+		chunk = deflate.flush()
+		written += len(chunk)
+		yield self._out(chunk)
+		crc &= 0xffffffff
+
+		if zip64:
+			yield self._out(_DESCRIPTOR64.pack(0x08074b50, crc, written, read))
+		else:
+			yield self._out(_DESCRIPTOR.pack(0x08074b50, crc, written, read))
+		self._record(version, flags, DEFLATED, dos_time, dos_date, crc, written, read, name,
+			(mode & 0xffff) << 16, offset, zip64)
+
+	def _stored(self, name, f, size, mtime, mode):
+		"""
+			A stored entry has its crc and sizes in the local header, as some
+			unzippers (java's ZipInputStream) cannot find where its data ends
+			otherwise, so the file is read twice: once for the crc, then to send
+		"""
+		name, flags = self._name(name)
+		dos_time, dos_date = _dos_time(mtime)
+		start = f.tell()
+		crc = 0
+		stored = 0
+		while stored < size:
+			chunk = f.read(min(self.CHUNK, size - stored))
+			if not chunk:
+				break  # the file shrank, archive what there is
+			stored += len(chunk)
+			crc = zlib.crc32(chunk, crc)
+		crc &= 0xffffffff
+		f.seek(start)
+		zip64 = stored >= _ZIP64_LIMIT
+		version = 45 if zip64 else 20
+		offset = self.offset
+		if zip64:
+			extra = struct.pack("<HHQQ", 1, 16, stored, stored)
+			header = _LOCAL.pack(0x04034b50, version, flags, STORED, dos_time, dos_date, crc, _ZIP64_LIMIT,
+				_ZIP64_LIMIT, len(name), len(extra)) + name + extra
+		else:
+			header = _LOCAL.pack(0x04034b50, version, flags, STORED, dos_time, dos_date, crc, stored, stored,
+				len(name), 0) + name
+		yield self._out(header)
+
+		left = stored
+		while left > 0:
+			chunk = f.read(min(self.CHUNK, left))
+			if not chunk:
+				# it shrank between the two reads, keep the sizes we announced
+				chunk = b"\0" * min(self.CHUNK, left)
+			left -= len(chunk)
+			yield self._out(chunk)
+		self._record(version, flags, STORED, dos_time, dos_date, crc, stored, stored, name,
+			(mode & 0xffff) << 16, offset, zip64)
+
+	def finish(self):
+		"""
+			The central directory and the end records, after the last entry
+			Yields: their bytes
+		"""
+		start = self.offset
+		for record in self._central:
+			yield self._out(record)
+		size = self.offset - start
+		count = len(self._central)
+		if count >= 0xffff or start >= _ZIP64_LIMIT or size >= _ZIP64_LIMIT:
+			end64 = self.offset
+			yield self._out(_END64.pack(0x06064b50, 44, 45, 45, 0, 0, count, count, size, start))
+			yield self._out(_LOCATOR64.pack(0x07064b50, 0, end64, 1))
+			yield self._out(_END.pack(0x06054b50, 0, 0, min(count, 0xffff), min(count, 0xffff),
+				min(size, _ZIP64_LIMIT), min(start, _ZIP64_LIMIT), 0))
+		else:
+			yield self._out(_END.pack(0x06054b50, 0, 0, count, count, size, start, 0))
+
+	@staticmethod
+	def _name(name):
+		name = raw_name(name)
+		try:
+			name.decode("utf-8")
+			return name, _FLAG_UTF8
+		except UnicodeDecodeError:
+			return name, 0
+
+	def _record(self, version, flags, method, dos_time, dos_date, crc, compressed, size, name,
+			attributes, offset, zip64):
+		extra = b""
+		if zip64:
+			extra += struct.pack("<QQ", size, compressed)
+			size = compressed = _ZIP64_LIMIT
+		if offset >= _ZIP64_LIMIT:
+			extra += struct.pack("<Q", offset)
+			offset = _ZIP64_LIMIT
+			version = 45
+		if extra:
+			extra = struct.pack("<HH", 1, len(extra)) + extra
+		self._central.append(_CENTRAL.pack(0x02014b50, 3 << 8 | version, version, flags, method, dos_time,
+			dos_date, crc, compressed, size, len(name), len(extra), 0, 0, 0, attributes, offset) + name + extra)
+
+
+def zip_directory(top, prefix, deflate):
+	"""
+		The ZIP archive of everything under a directory, as it is generated
+		top: the directory
+		prefix: the folder the archive unpacks to
+		deflate: called with each file's path, True to compress it, False to
+		store it as it is
+		Yields: the archive's bytes, chunk by chunk
+	"""
+	archive = ZipStream()
+	for path, dirs, files in os.walk(top):
+		dirs.sort()
+		relative = os.path.relpath(path, top)
+		folder = prefix if relative == os.curdir else prefix + "/" + relative.replace(os.sep, "/")
+		try:
+			mtime = os.stat(path).st_mtime
+		except OSError:
+			continue
+		for chunk in archive.directory(folder + "/", mtime):
+			yield chunk
+		for name in sorted(files):
+			fullname = os.path.join(path, name)
+			if not os.path.isfile(fullname):
+				continue  # a fifo would block us, sockets and devices have no data
+			try:
+				f = open(fullname, "rb")
+			except IOError:
+				continue  # unreadable, left out
+			try:
+				st = os.fstat(f.fileno())
+				method = DEFLATED if deflate(fullname) else STORED
+				for chunk in archive.file(folder + "/" + name, f, st.st_size, st.st_mtime, st.st_mode, method):
+					yield chunk
+			finally:
+				f.close()
+	for chunk in archive.finish():
+		yield chunk